@@ -0,0 +1,279 @@
+import os
+import sys
+import time
+import pathlib
+import sqlite3
+import logging
+import argparse
+import datetime
+import threading
+from collections import namedtuple
+import db
+
+# 線上熱備份：營業中不用關程式，用 sqlite3 backup API 把 pos.db 複製成一個完整的備份檔
+#
+# 整個備份在來源連線的同一個讀取交易內分批（PAGES_PER_STEP 頁）複製，每批之間暫停一下讓出 I/O：
+#   - 備份內容是開始那一刻的資料，期間的新訂單不會讓備份從頭來過
+#   - WAL 下讀取交易不會擋住寫入，備份全程不拿寫入鎖，送出訂單不受影響
+# 備份檔放在 POS_BACKUP_DIR（預設資料庫旁的 backups/），檔名 pos-YYYYMMDD-HHMMSS.db，
+# 只保留最新 POS_BACKUP_KEEP 份；主程式 / 伺服器開著時每 POS_BACKUP_INTERVAL_MIN 分鐘備份一次。
+PAGES_PER_STEP = 256      # 每批複製的頁數（預設頁大小 4KB，約 1MB）
+STEP_PAUSE = 0.01         # 每批之間暫停的秒數
+KEEP = int(os.environ.get("POS_BACKUP_KEEP") or 24)
+INTERVAL_MIN = float(os.environ.get("POS_BACKUP_INTERVAL_MIN") or 60)   # 0 代表不排程
+
+PREFIX = "pos-"
+SUFFIX = ".db"
+
+logger = logging.getLogger("pos.backup")
+
+# 驗證結果：ok 為 False 時看 error
+BackupInfo = namedtuple("BackupInfo", "path ok schema_version products orders error")
+
+
+def backup_dir(path=None):
+    """備份目錄：參數、POS_BACKUP_DIR，預設為資料庫旁的 backups/"""
+    return os.path.abspath(path or os.environ.get("POS_BACKUP_DIR")
+                           or os.path.join(os.path.dirname(db.DB_FILE), "backups"))
+
+
+def backup_name(now=None):
+    return f"{PREFIX}{(now or datetime.datetime.now()):%Y%m%d-%H%M%S}{SUFFIX}"
+
+
+def _read_only(path):
+    """唯讀開啟備份檔（檔案不存在時丟錯，不會建立空檔）"""
+    return sqlite3.connect(pathlib.Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+
+
+# ---------------------------
+# 備份 / 輪替
+# ---------------------------
+def backup(dest=None, db_file=None, pages=PAGES_PER_STEP, pause=STEP_PAUSE, progress=None, directory=None):
+    """線上備份資料庫到 dest（預設在備份目錄下以時間命名），回傳備份檔名
+
+    progress(done, total)：每複製一批呼叫一次（頁數）
+    先寫到 dest.part，完成後才改名，中途失敗不會留下不完整的備份。
+    """
+    if dest is None:
+        directory = backup_dir(directory)
+        os.makedirs(directory, exist_ok=True)
+        dest = os.path.join(directory, backup_name())
+    tmp = dest + ".part"
+
+    def step(status, remaining, total):
+        if progress:
+            progress(total - remaining, total)
+        if remaining and pause:
+            time.sleep(pause)
+
+    src = db.get_connection(db_file)
+    try:
+        src.execute("PRAGMA query_only = ON")
+        # 先開讀取交易並固定快照：之後每一批都從同一個快照讀，其他連線寫入不會讓備份重來
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        dst = sqlite3.connect(tmp)
+        try:
+            src.backup(dst, pages=pages, progress=step)
+            # 備份檔是單一檔案，不帶 -wal
+            dst.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            dst.close()
+        src.rollback()
+        os.replace(tmp, dest)
+        return dest
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        src.close()
+
+
+def list_backups(directory=None):
+    """備份目錄中的備份檔，舊到新"""
+    directory = backup_dir(directory)
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(n for n in os.listdir(directory) if n.startswith(PREFIX) and n.endswith(SUFFIX))
+    return [os.path.join(directory, n) for n in names]
+
+
+def rotate(directory=None, keep=KEEP):
+    """只保留最新 keep 份備份，回傳刪除的檔案"""
+    removed = list_backups(directory)[:-keep] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+# ---------------------------
+# 驗證 / 還原
+# ---------------------------
+def verify(path):
+    """檢查備份檔是否完整可用（integrity_check、資料表版本），回傳 BackupInfo"""
+    try:
+        conn = _read_only(path)
+    except sqlite3.Error as e:
+        return BackupInfo(path, False, None, None, None, f"無法開啟：{e}")
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        if problems != ["ok"]:
+            return BackupInfo(path, False, None, None, None, "；".join(problems[:5]))
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > db.SCHEMA_VERSION:
+            return BackupInfo(path, False, version, None, None,
+                              f"備份的資料表版本 {version} 比程式（{db.SCHEMA_VERSION}）新")
+        products = conn.execute("SELECT COUNT(*) FROM PRODUCT").fetchone()[0]
+        orders = conn.execute("SELECT COUNT(*) FROM ORDER_MASTER").fetchone()[0]
+        return BackupInfo(path, True, version, products, orders, None)
+    except sqlite3.Error as e:
+        return BackupInfo(path, False, None, None, None, str(e))
+    finally:
+        conn.close()
+
+
+def restore(path, db_file=None, keep_current=True, directory=None):
+    """用備份檔取代資料庫內容，回傳還原前另存的目前資料庫備份（沒有另存時為 None）
+
+    先驗證備份檔，失敗丟 ValueError。用 backup API 寫回目前的資料庫（不直接覆蓋檔案，
+    -wal 也會一致）。請在所有終端機與伺服器都關閉時執行。
+    """
+    info = verify(path)
+    if not info.ok:
+        raise ValueError(f"備份檔驗證失敗：{info.error}")
+
+    target = os.path.abspath(db_file or db.DB_FILE)
+    saved = None
+    if keep_current and os.path.exists(target):
+        directory = backup_dir(directory)
+        os.makedirs(directory, exist_ok=True)
+        saved = backup(os.path.join(directory, "pre-restore-" + backup_name()), target)
+
+    src = _read_only(path)
+    dst = db.get_connection(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return saved
+
+
+# ---------------------------
+# 排程
+# ---------------------------
+class BackupScheduler:
+    """主程式 / 伺服器開著時，在背景執行緒每 interval_min 分鐘備份一次並輪替"""
+
+    def __init__(self, interval_min=INTERVAL_MIN, directory=None, keep=KEEP):
+        self.interval = interval_min * 60
+        self.directory = directory
+        self.keep = keep
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pos-backup", daemon=True)
+
+    def start(self):
+        if self.interval > 0:
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        """做一次備份 + 輪替，回傳備份檔名（失敗時記 log 並回傳 None）"""
+        try:
+            t0 = time.perf_counter()
+            path = backup(directory=self.directory)
+            removed = rotate(self.directory, self.keep)
+        except Exception as e:
+            logger.warning("自動備份失敗：%s", e)
+            return None
+        logger.info("已備份 %s（%.1f 秒，刪除 %d 份舊備份）", path, time.perf_counter() - t0, len(removed))
+        return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="資料庫線上備份 / 驗證 / 還原")
+    parser.add_argument("--db", help=f"資料庫檔（預設 {db.DB_FILE}，或設定 POS_DB）")
+    parser.add_argument("--dir", help="備份目錄（預設 POS_BACKUP_DIR 或資料庫旁的 backups/）")
+    sub = parser.add_subparsers(dest="command", required=True)
+    n = sub.add_parser("now", help="立即備份一次並輪替")
+    n.add_argument("--keep", type=int, default=KEEP, help="保留幾份")
+    sub.add_parser("list", help="列出備份檔")
+    v = sub.add_parser("verify", help="驗證備份檔")
+    v.add_argument("path", nargs="?", help="備份檔（預設最新一份）")
+    r = sub.add_parser("restore", help="用備份檔還原資料庫（請先關閉所有終端機與伺服器）")
+    r.add_argument("path")
+    r.add_argument("--yes", action="store_true", help="不再確認")
+    s = sub.add_parser("run", help="持續定時備份（搭配伺服器或排程器使用）")
+    s.add_argument("--interval", type=float, default=INTERVAL_MIN or 60, help="幾分鐘備份一次")
+    s.add_argument("--keep", type=int, default=KEEP, help="保留幾份")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.set_db_file(args.db)
+
+    if args.command == "now":
+        try:
+            path = backup(directory=args.dir)
+        except sqlite3.Error as e:
+            print(f"備份失敗：{e}", file=sys.stderr)
+            return 1
+        removed = rotate(args.dir, args.keep)
+        print(f"{path}（刪除 {len(removed)} 份舊備份）")
+        return 0
+
+    if args.command == "list":
+        for path in list_backups(args.dir):
+            print(f"{os.path.basename(path)}  {os.path.getsize(path) / 1048576:8.1f} MB")
+        return 0
+
+    if args.command == "verify":
+        path = args.path or (list_backups(args.dir) or [None])[-1]
+        if path is None:
+            print("沒有任何備份", file=sys.stderr)
+            return 2
+        info = verify(path)
+        if not info.ok:
+            print(f"{path}：驗證失敗：{info.error}", file=sys.stderr)
+            return 1
+        print(f"{path}：OK（版本 {info.schema_version}，{info.products} 項商品，{info.orders} 筆訂單）")
+        return 0
+
+    if args.command == "restore":
+        if not args.yes:
+            answer = input(f"確定要用 {args.path} 取代 {db.DB_FILE} 的內容嗎？(y/N) ")
+            if answer.strip().lower() != "y":
+                return 1
+        try:
+            saved = restore(args.path, directory=args.dir)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        db.init_db()
+        if saved:
+            print(f"還原前的資料庫已另存為 {saved}")
+        print("還原完成")
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    scheduler = BackupScheduler(args.interval, args.dir, args.keep)
+    print(f"每 {args.interval:g} 分鐘備份 {db.DB_FILE} 到 {backup_dir(args.dir)}（Ctrl+C 結束）", flush=True)
+    try:
+        while True:
+            scheduler.run_once()
+            time.sleep(scheduler.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
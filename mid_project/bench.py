@@ -0,0 +1,335 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import datetime
+import threading
+
+import db
+from order_id import TERMINAL_DIGITS, MAX_TERMINAL
+
+# 效能量測：先用 generate 產生指定規模的假資料庫，再用 run 量測實際程式路徑，
+# 結果輸出成 JSON，可用 --compare 和上一次的結果比較、找出變慢的項目。
+#
+#   python bench.py generate bench.db --products 10000 --deleted 0.1 --orders 1000000 --lines 5
+#   python bench.py run bench.db -o result.json --compare baseline.json
+#
+# 注意：run 會在資料庫內新增 / 完成訂單（相對於產生的資料量很少）；
+# 要完全相同的起點請用相同的 --seed 重新 generate。
+
+SYNTHETIC_TERMINAL = MAX_TERMINAL + 1    # 假訂單使用的終端機編號，實際終端機不會配發到
+BATCH_ORDERS = 10000        # 產生資料時每批寫入的訂單數
+
+
+# ---------------------------
+# 產生資料
+# ---------------------------
+def generate(path, products=1000, deleted=0.1, orders=100000, lines=5,
+             pending=50, days=365, seed=1):
+    """建立一個新的 pos.db 並填入假資料，回傳各表筆數"""
+    if os.path.exists(path):
+        raise ValueError(f"{path} 已存在，請先刪除或換一個檔名")
+    rnd = random.Random(seed)
+
+    conn = db.get_connection(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    # 產生資料不需要 crash safety
+    conn.execute("PRAGMA synchronous = OFF")
+    cur = conn.cursor()
+    cur.execute("BEGIN")
+    db.migrate(cur)
+
+    # 商品：部分軟刪除；庫存給很大，量測送出訂單時不會賣完
+    rows = []
+    for n in range(1, products + 1):
+        is_deleted = 1 if rnd.random() < deleted else 0
+        rows.append((db.format_pid(n), f"商品{n:06d}", round(rnd.uniform(10, 300), 0), 10 ** 9, is_deleted))
+    cur.executemany("INSERT INTO PRODUCT (PID, NAME, PRICE, STOCK, DELETED) VALUES (?, ?, ?, ?, ?)", rows)
+    cur.execute("UPDATE ID_SEQUENCE SET VALUE = ? WHERE NAME = 'PID'", (products,))
+    prices = {pid: price for pid, name, price, stock, is_deleted in rows}
+    pids = list(prices)
+    conn.commit()
+
+    # 訂單：平均分布在過去 days 天，最新的 pending 筆未完成
+    end = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(minutes=1)
+    start = end - datetime.timedelta(days=days)
+    step = (end - start) / max(orders, 1)
+    detail_count = 0
+    for batch_start in range(0, orders, BATCH_ORDERS):
+        cur.execute("BEGIN")
+        masters = []
+        details = []
+        for i in range(batch_start, min(batch_start + BATCH_ORDERS, orders)):
+            dt = start + step * i
+            oid = (f"O{dt:%Y%m%d%H%M%S}{dt.microsecond // 1000:03d}"
+                   f"{SYNTHETIC_TERMINAL:0{TERMINAL_DIGITS}d}{i % 1000:03d}")
+            total = 0
+            for pid in rnd.sample(pids, min(len(pids), rnd.randint(1, 2 * lines - 1))):
+                qty = rnd.randint(1, 3)
+                subtotal = prices[pid] * qty
+                total += subtotal
+                details.append((oid, pid, qty, subtotal))
+            completed = 0 if i >= orders - pending else 1
+            masters.append((oid, dt.strftime("%Y-%m-%d %H:%M:%S"), total, completed))
+        cur.executemany("INSERT INTO ORDER_MASTER (OID, DATE, TOTAL, COMPLETED) VALUES (?, ?, ?, ?)", masters)
+        cur.executemany("INSERT INTO ORDER_DETAIL (OID, PID, QTY, SUBTOTAL) VALUES (?, ?, ?, ?)", details)
+        detail_count += len(details)
+        conn.commit()
+
+    conn.execute("ANALYZE")
+    conn.close()
+    return {"products": products, "orders": orders, "order_details": detail_count}
+
+
+# ---------------------------
+# 量測
+# ---------------------------
+def summarize(samples):
+    """秒數 list -> 統計（毫秒）"""
+    samples = sorted(samples)
+    n = len(samples)
+
+    def pct(p):
+        return samples[min(n - 1, int(p * n))] * 1000
+
+    return {
+        "n": n,
+        "total_s": round(sum(samples), 6),
+        "mean_ms": round(sum(samples) / n * 1000, 4),
+        "p50_ms": round(pct(0.50), 4),
+        "p95_ms": round(pct(0.95), 4),
+        "p99_ms": round(pct(0.99), 4),
+        "min_ms": round(samples[0] * 1000, 4),
+        "max_ms": round(samples[-1] * 1000, 4),
+    }
+
+
+def measure(func, repeat):
+    samples = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples)
+
+
+def run(path, repeat=100, threads=4, seed=1):
+    """在 path 上量測各個實際程式路徑，回傳 {名稱: 統計}"""
+    if not os.path.exists(path):
+        raise ValueError(f"找不到 {path}，請先執行 generate")
+    # 以下模組都透過 db 的全域連線存取，必須在第一次連線前指定檔案
+    db.set_db_file(path)
+    db.init_db()
+
+    from services import CartService, CatalogService, OrderService
+    from catalog_cache import CatalogCache
+    from order_store import OrderCache, fetch_order_history, get_order, iter_orders
+
+    rnd = random.Random(seed)
+    catalog = CatalogService()
+    orders = OrderService()
+    results = {}
+
+    # 商品
+    results["generate_pid"] = measure(lambda i: _generate_pid(), repeat)
+    results["list_products"] = measure(lambda i: catalog.list_products(), max(1, repeat // 10))
+    results["catalog_cache_full_load"] = measure(
+        lambda i: CatalogCache(catalog).refresh(), max(1, repeat // 10))
+    cache = CatalogCache(catalog)
+    cache.refresh()
+    results["catalog_cache_refresh_unchanged"] = measure(lambda i: cache.refresh(), repeat)
+    active = cache.active()
+
+    # 送出訂單（經 WritePipeline，回傳時已確實寫入）
+    def new_cart():
+        cart = CartService()
+        chosen = rnd.sample(active, min(len(active), rnd.randint(1, 5)))
+        cart.load_products(chosen)
+        for pid, name, price, stock in chosen:
+            cart.add(pid, rnd.randint(1, 3))
+        return cart
+
+    submitted = []
+
+    def submit(i):
+        result = orders.submit(new_cart())
+        if not result.ok:
+            raise RuntimeError(f"送出失敗：{result.error}")
+        submitted.append(result.oid)
+
+    results["submit_order"] = measure(submit, repeat)
+    results["submit_order_concurrent"] = _measure_concurrent(submit, repeat, threads)
+
+    # 報表
+    results["report_reload"] = measure(lambda i: OrderCache(orders).reload(), max(1, repeat // 10))
+    history = []
+
+    def history_page(i):
+        after = history[-1] if history else None
+        page = fetch_order_history(after, 100, completed=True)
+        history.append(page.next_key)
+
+    results["order_history_page"] = measure(history_page, max(1, repeat // 5))
+    sample_oids = _sample_oids(rnd, min(repeat, 1000))
+    results["get_order"] = measure(lambda i: get_order(sample_oids[i % len(sample_oids)]), repeat)
+    results["iter_pending_orders"] = measure(lambda i: sum(1 for o in iter_orders(completed=False)),
+                                             max(1, repeat // 10))
+
+    # 完成訂單
+    results["complete_order"] = measure(lambda i: orders.complete(submitted[i]), min(repeat, len(submitted)))
+    # 其餘送出的訂單也完成，下一次量測時未完成訂單數不變
+    for oid in submitted[repeat:]:
+        orders.complete(oid)
+    return results
+
+
+def _generate_pid():
+    with db.transaction() as cur:
+        db.generate_pid(cur)
+
+
+def _sample_oids(rnd, count):
+    """隨機挑 count 筆訂單編號（依 ROWID 抽樣，不必把整張表讀進記憶體）"""
+    with db.read_cursor() as cur:
+        cur.execute("SELECT MAX(ROWID) FROM ORDER_MASTER")
+        max_rowid = cur.fetchone()[0] or 0
+        oids = []
+        for rowid in rnd.sample(range(1, max_rowid + 1), min(count, max_rowid)):
+            cur.execute("SELECT OID FROM ORDER_MASTER WHERE ROWID = ?", (rowid,))
+            row = cur.fetchone()
+            if row:
+                oids.append(row[0])
+        return oids
+
+
+def _measure_concurrent(func, repeat, threads):
+    """threads 個執行緒同時呼叫 func，共 repeat 次；另外記錄每秒處理量"""
+    samples = []
+    lock = threading.Lock()
+    counter = iter(range(repeat))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            t0 = time.perf_counter()
+            func(i)
+            with lock:
+                samples.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - t0
+    stats = summarize(samples)
+    stats["threads"] = threads
+    stats["per_second"] = round(len(samples) / elapsed, 2)
+    return stats
+
+
+# ---------------------------
+# 結果
+# ---------------------------
+def describe(path):
+    """資料庫規模與執行環境，寫進結果方便比較"""
+    conn = db.get_connection(path)
+    try:
+        counts = {}
+        for table in ("PRODUCT", "ORDER_MASTER", "ORDER_DETAIL"):
+            counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        counts["PRODUCT_DELETED"] = conn.execute("SELECT COUNT(*) FROM PRODUCT WHERE DELETED = 1").fetchone()[0]
+        schema = conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+    return {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "schema_version": schema,
+        "db_bytes": os.path.getsize(path),
+        "rows": counts,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """和上一次的結果比較 p50；回傳變慢超過 tolerance（比例）的項目"""
+    regressions = []
+    for name, stats in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old or not old.get("p50_ms"):
+            continue
+        ratio = stats["p50_ms"] / old["p50_ms"]
+        mark = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            mark = "  <-- 變慢"
+        print(f"{name:34s} {old['p50_ms']:10.3f} -> {stats['p50_ms']:10.3f} ms  x{ratio:.2f}{mark}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="點餐系統效能量測")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    g = sub.add_parser("generate", help="產生假資料庫")
+    g.add_argument("path")
+    g.add_argument("--products", type=int, default=1000)
+    g.add_argument("--deleted", type=float, default=0.1, help="軟刪除商品比例")
+    g.add_argument("--orders", type=int, default=100000)
+    g.add_argument("--lines", type=int, default=5, help="每筆訂單平均明細數")
+    g.add_argument("--pending", type=int, default=50, help="最新幾筆設為未完成")
+    g.add_argument("--days", type=int, default=365, help="訂單分布在過去幾天")
+    g.add_argument("--seed", type=int, default=1)
+
+    r = sub.add_parser("run", help="量測並輸出 JSON")
+    r.add_argument("path")
+    r.add_argument("-o", "--output", help="結果 JSON 檔（預設輸出到 stdout）")
+    r.add_argument("--repeat", type=int, default=100)
+    r.add_argument("--threads", type=int, default=4, help="同時送出訂單的執行緒數")
+    r.add_argument("--seed", type=int, default=1)
+    r.add_argument("--compare", help="上一次的結果 JSON")
+    r.add_argument("--tolerance", type=float, default=0.2, help="p50 變慢超過這個比例視為退步")
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "generate":
+            t0 = time.perf_counter()
+            counts = generate(args.path, args.products, args.deleted, args.orders, args.lines,
+                              args.pending, args.days, args.seed)
+            print(f"已產生 {args.path}：{counts}（{time.perf_counter() - t0:.1f} 秒）")
+            return 0
+
+        results = run(args.path, args.repeat, args.threads, args.seed)
+        db.close_db()
+        report = {"meta": describe(args.path), "results": results}
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
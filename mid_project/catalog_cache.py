@@ -0,0 +1,86 @@
+import threading
+from collections import namedtuple
+from services import catalog_service
+
+# 一筆商品（含已刪除的，歷史訂單查名稱時用）
+Product = namedtuple("Product", "pid name price stock deleted")
+
+
+class CatalogCache:
+    """全程序共用的商品快取，以 PID 為 key
+
+    靠 PRODUCT.ROW_VERSION 與 PRODUCT_VERSION 計數器（由 trigger 維護）判斷變動：
+    refresh() 只讀回版本比上次新的那幾列，其他終端機改過的商品也會被發現。
+    有變動時通知 subscribe() 註冊的畫面（callback 收到變動的 PID 集合）。
+    """
+
+    def __init__(self, source):
+        # source：提供 changed_products(since) 的商品服務（本機或伺服器版本）
+        self.source = source
+        self.products = {}     # pid -> Product
+        self.version = None    # 已同步到的 PRODUCT_VERSION；None 代表還沒載入
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    # ---------------------------
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def refresh(self, notify=True):
+        """和資料庫同步，回傳有變動的 PID 集合（沒有變動時只花一次計數器查詢）"""
+        with self._lock:
+            since = -1 if self.version is None else self.version
+            version, rows = self.source.changed_products(since)
+            changed = set()
+            for pid, name, price, stock, deleted in rows:
+                self.products[pid] = Product(pid, name, price, stock, bool(deleted))
+                changed.add(pid)
+            self.version = version
+
+        if notify:
+            self.notify(changed)
+        return changed
+
+    def notify(self, changed):
+        """通知訂閱的畫面（refresh(notify=False) 在背景執行緒同步後，回到畫面執行緒再呼叫）"""
+        if changed:
+            for callback in list(self._listeners):
+                callback(changed)
+
+    def ensure_loaded(self):
+        if self.version is None:
+            self.refresh(notify=False)
+
+    # ---------------------------
+    def get(self, pid):
+        return self.products.get(pid)
+
+    def name(self, pid):
+        """商品名稱（已刪除的也查得到）；完全沒有這個 PID 時標示為已刪除"""
+        product = self.products.get(pid)
+        return product.name if product else f"[已刪除] {pid}"
+
+    def active(self):
+        """未刪除商品 [(pid, name, price, stock)]，依 PID 排序"""
+        self.ensure_loaded()
+        # 背景執行緒可能同時在 refresh()，在鎖內取快照
+        with self._lock:
+            items = sorted(self.products.items())
+        return [(p.pid, p.name, p.price, p.stock) for pid, p in items if not p.deleted]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_catalog_cache():
+    """全域共用的商品快取"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CatalogCache(catalog_service())
+        return _cache
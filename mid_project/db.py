@@ -1,16 +1,234 @@
+import os
 import sqlite3
+import threading
+import queue
+import atexit
+from contextlib import contextmanager
+import sql_stats
 
-DB_FILE = "pos.db"
+# 資料庫檔：POS_DB 環境變數（或各程式的 --db 參數）；
+# 預設為程式所在目錄的 pos.db，不會因為從別的目錄啟動就開到另一個空的資料庫
+DB_FILE = os.path.abspath(os.environ.get("POS_DB")
+                          or os.path.join(os.path.dirname(os.path.abspath(__file__)), "pos.db"))
 
-def get_connection():
-    return sqlite3.connect(DB_FILE)
+# 每條連線建立時套用一次的 PRAGMA
+# journal_mode=WAL 會寫進資料庫檔，讀寫可並行；synchronous=NORMAL 在 WAL 下仍不會損毀資料
+CONNECTION_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",      # 遇到鎖最多等 5 秒，而不是直接丟 database is locked
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",      # 約 16MB page cache
+    "PRAGMA mmap_size = 268435456",    # 256MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+
+READER_POOL_SIZE = 3
+
+
+def get_connection(db_file=None):
+    """建立一條已調校過的新連線（長駐連線與獨立工具都由此取得）
+
+    啟用 SQL 量測（見 sql_stats）時回傳會記錄每個語句的連線，否則為一般連線。
+    """
+    conn = sqlite3.connect(db_file or DB_FILE, check_same_thread=False, isolation_level=None,
+                           factory=sql_stats.connection_factory())
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionManager:
+    """長駐連線管理：一條寫入連線 + 少量讀取連線池，避免每次操作都 connect/close"""
+
+    def __init__(self, db_file=None, readers=READER_POOL_SIZE):
+        self.db_file = db_file or DB_FILE
+        self.reader_count = readers
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._readers = queue.LifoQueue()
+        self._opened = 0
+        self._open_lock = threading.Lock()     # 鎖的順序一律是先 _write_lock 再 _open_lock
+        self._closed = False
+
+    # ---------------------------
+    def writer(self):
+        """取得唯一的寫入連線（第一次呼叫時建立並切換成 WAL）"""
+        with self._open_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("ConnectionManager 已關閉")
+            if self._writer is None:
+                conn = get_connection(self.db_file)
+                conn.execute("PRAGMA journal_mode = WAL")
+                self._writer = conn
+            return self._writer
+
+    # ---------------------------
+    @contextmanager
+    def transaction(self, immediate=True, durable=False):
+        """寫入交易：with 區塊正常結束就 COMMIT，發生例外就 ROLLBACK
+
+        預設 BEGIN IMMEDIATE，一開始就拿到寫入鎖，避免交易中途才升級失敗。
+        同一執行緒巢狀呼叫時改用 SAVEPOINT：內層失敗只還原內層，外層交易繼續。
+        durable=True 時這次 COMMIT 用 synchronous=FULL（確實寫到磁碟才返回）。
+        """
+        with self._write_lock:
+            conn = self.writer()
+            if conn.in_transaction:
+                conn.execute("SAVEPOINT nested")
+                try:
+                    yield conn.cursor()
+                except BaseException:
+                    conn.execute("ROLLBACK TO nested")
+                    conn.execute("RELEASE nested")
+                    raise
+                else:
+                    conn.execute("RELEASE nested")
+                return
+
+            if durable:
+                conn.execute("PRAGMA synchronous = FULL")
+            try:
+                conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+                try:
+                    yield conn.cursor()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                else:
+                    conn.commit()
+            finally:
+                if durable:
+                    conn.execute("PRAGMA synchronous = NORMAL")
+
+    # ---------------------------
+    def _acquire_reader(self):
+        # 先確保寫入連線已建立（WAL 必須在其他連線開啟前切換）
+        if self._writer is None:
+            self.writer()
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._open_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("ConnectionManager 已關閉")
+            if self._opened < self.reader_count:
+                self._opened += 1
+                conn = get_connection(self.db_file)
+                conn.execute("PRAGMA query_only = ON")
+                return conn
+        # 池子用完就等別人歸還（等待中被關閉時不會一直等下去）
+        while True:
+            try:
+                return self._readers.get(timeout=1)
+            except queue.Empty:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("ConnectionManager 已關閉") from None
+
+    @contextmanager
+    def reading(self):
+        """從讀取池借一條連線，用完自動歸還"""
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._open_lock:
+                # close() 之後才歸還的連線直接關閉
+                if self._closed:
+                    conn.close()
+                else:
+                    self._readers.put(conn)
+
+    @contextmanager
+    def read_cursor(self):
+        """借一條讀取連線並回傳 cursor；離開時關閉 cursor 以釋放讀取快照"""
+        with self.reading() as conn:
+            cur = conn.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+
+    # ---------------------------
+    def close(self):
+        """關閉所有連線（程式結束時呼叫）"""
+        # 先等進行中的寫入交易結束（和 transaction() 一樣先 _write_lock 再 _open_lock）
+        with self._write_lock, self._open_lock:
+            self._closed = True
+            while True:
+                try:
+                    self._readers.get_nowait().close()
+                except queue.Empty:
+                    break
+            if self._writer is not None:
+                try:
+                    self._writer.execute("PRAGMA optimize")
+                except sqlite3.Error:
+                    pass
+                self._writer.close()
+                self._writer = None
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """取得全域共用的 ConnectionManager"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ConnectionManager()
+            atexit.register(_manager.close)
+        return _manager
+
+
+def transaction(immediate=True, durable=False):
+    return get_manager().transaction(immediate, durable)
+
+
+def read_cursor():
+    return get_manager().read_cursor()
+
+
+@contextmanager
+def read_snapshot():
+    """多個 SELECT 需要看到同一個時間點的資料時使用（包在同一個讀取交易內）"""
+    with get_manager().reading() as conn:
+        conn.execute("BEGIN")
+        cur = conn.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+            conn.rollback()
 
-def init_db():
-    conn = get_connection()
-    cur = conn.cursor()
 
-    # 商品表
-    cur.execute('''
+def close_db():
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close()
+            _manager = None
+
+
+def set_db_file(path):
+    """改用另一個資料庫檔（程式啟動時、存取資料庫前呼叫）"""
+    global DB_FILE
+    close_db()
+    DB_FILE = os.path.abspath(path)
+
+
+# ---------------------------
+# Schema migrations：依序執行，已執行到第幾版記錄在 PRAGMA user_version
+# 每一版是一串 SQL 字串或 callable(cur)，只會在版本號較舊時跑一次
+# 注意：只能在尾端新增版本，不可修改已發佈的版本
+MIGRATIONS = [
+    # v1：初始三張表（舊的 pos.db 已存在也沒關係）
+    (
+        # 商品表
+        '''
         CREATE TABLE IF NOT EXISTS PRODUCT (
             PID TEXT PRIMARY KEY,
             NAME TEXT,
@@ -18,42 +236,256 @@ def init_db():
             STOCK INTEGER,
             DELETED INTEGER DEFAULT 0
         )
-    ''')
-
-    # 訂單主檔
-    cur.execute('''
+        ''',
+        # 訂單主檔
+        '''
         CREATE TABLE IF NOT EXISTS ORDER_MASTER (
             OID TEXT PRIMARY KEY,
             DATE TEXT,
             TOTAL REAL,
             COMPLETED INTEGER DEFAULT 0
         )
-    ''')
-
-    # 訂單明細
-    cur.execute('''
+        ''',
+        # 訂單明細
+        '''
         CREATE TABLE IF NOT EXISTS ORDER_DETAIL (
             OID TEXT,
             PID TEXT,
             QTY INTEGER,
             SUBTOTAL REAL
         )
-    ''')
+        ''',
+    ),
+    # v2：報表與商品頁最常用查詢的索引
+    (
+        # 每筆訂單的明細：WHERE OID = ?
+        "CREATE INDEX IF NOT EXISTS IDX_ORDER_DETAIL_OID ON ORDER_DETAIL (OID)",
+        # 未完成 / 已完成清單：WHERE COMPLETED = ? ORDER BY OID
+        "CREATE INDEX IF NOT EXISTS IDX_ORDER_MASTER_COMPLETED ON ORDER_MASTER (COMPLETED, OID)",
+        # 舊版修改商品時沒有檢查名稱，可能已有同名的未刪除商品：
+        # 保留 PID 最小的那一筆，其餘在名稱後面加上 PID，唯一索引才建得起來
+        '''
+        UPDATE PRODUCT SET NAME = NAME || ' (' || PID || ')'
+        WHERE DELETED = 0 AND EXISTS (
+            SELECT 1 FROM PRODUCT P
+            WHERE P.NAME = PRODUCT.NAME AND P.DELETED = 0 AND P.PID < PRODUCT.PID
+        )
+        ''',
+        # 商品名稱不可重複（只限未刪除的商品）：WHERE NAME = ? AND DELETED = 0
+        "CREATE UNIQUE INDEX IF NOT EXISTS UX_PRODUCT_NAME_ACTIVE ON PRODUCT (NAME) WHERE DELETED = 0",
+    ),
+    # v3：流水號計數表，PID 改由計數器配發（不用再掃整張 PRODUCT）
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS ID_SEQUENCE (
+            NAME TEXT PRIMARY KEY,
+            VALUE INTEGER NOT NULL
+        )
+        ''',
+        # 從既有商品的最大流水號接續（只在升級時掃一次）
+        '''
+        INSERT OR IGNORE INTO ID_SEQUENCE (NAME, VALUE)
+        SELECT 'PID', COALESCE(MAX(CAST(SUBSTR(PID, 2) AS INTEGER)), 0) FROM PRODUCT
+        ''',
+    ),
+    # v4：訂單歷史依 (DATE, OID) 做 keyset 分頁
+    (
+        "CREATE INDEX IF NOT EXISTS IDX_ORDER_MASTER_DATE ON ORDER_MASTER (DATE, OID)",
+        "CREATE INDEX IF NOT EXISTS IDX_ORDER_MASTER_COMPLETED_DATE ON ORDER_MASTER (COMPLETED, DATE, OID)",
+    ),
+    # v5：商品變更計數器，商品快取只需重新讀取 ROW_VERSION 較新的列
+    # 任何連線（包含其他終端機）改到 PRODUCT，trigger 都會把 PRODUCT_VERSION +1 並記到該列
+    (
+        "ALTER TABLE PRODUCT ADD COLUMN ROW_VERSION INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS IDX_PRODUCT_ROW_VERSION ON PRODUCT (ROW_VERSION)",
+        "INSERT OR IGNORE INTO ID_SEQUENCE (NAME, VALUE) VALUES ('PRODUCT_VERSION', 0)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_PRODUCT_INSERT_VERSION AFTER INSERT ON PRODUCT
+        BEGIN
+            UPDATE ID_SEQUENCE SET VALUE = VALUE + 1 WHERE NAME = 'PRODUCT_VERSION';
+            UPDATE PRODUCT SET ROW_VERSION = (SELECT VALUE FROM ID_SEQUENCE WHERE NAME = 'PRODUCT_VERSION')
+            WHERE PID = NEW.PID;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_PRODUCT_UPDATE_VERSION AFTER UPDATE OF PID, NAME, PRICE, STOCK, DELETED ON PRODUCT
+        BEGIN
+            UPDATE ID_SEQUENCE SET VALUE = VALUE + 1 WHERE NAME = 'PRODUCT_VERSION';
+            UPDATE PRODUCT SET ROW_VERSION = (SELECT VALUE FROM ID_SEQUENCE WHERE NAME = 'PRODUCT_VERSION')
+            WHERE PID = NEW.PID;
+        END
+        ''',
+    ),
+    # v6：銷售統計表（每日 / 每小時 / 每日每商品），由 trigger 隨訂單寫入同一個交易累加，
+    # 報表不必再掃 ORDER_DETAIL；既有資料在升級時重算一次（之後可用 sales.py rebuild 重算）
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS SALES_DAILY (
+            DAY TEXT PRIMARY KEY,          -- YYYY-MM-DD
+            ORDERS INTEGER NOT NULL,
+            QTY INTEGER NOT NULL,
+            REVENUE REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS SALES_HOURLY (
+            HOUR TEXT PRIMARY KEY,         -- YYYY-MM-DD HH
+            ORDERS INTEGER NOT NULL,
+            QTY INTEGER NOT NULL,
+            REVENUE REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS SALES_PRODUCT (
+            DAY TEXT NOT NULL,
+            PID TEXT NOT NULL,
+            ORDERS INTEGER NOT NULL,
+            QTY INTEGER NOT NULL,
+            REVENUE REAL NOT NULL,
+            PRIMARY KEY (DAY, PID)
+        ) WITHOUT ROWID
+        ''',
+        # 主檔：筆數與營業額（ORDER_MASTER.TOTAL）
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_SALES_ORDER_INSERT AFTER INSERT ON ORDER_MASTER
+        BEGIN
+            INSERT INTO SALES_DAILY (DAY, ORDERS, QTY, REVENUE)
+            VALUES (SUBSTR(NEW.DATE, 1, 10), 1, 0, NEW.TOTAL)
+            ON CONFLICT (DAY) DO UPDATE SET ORDERS = ORDERS + 1, REVENUE = REVENUE + excluded.REVENUE;
+            INSERT INTO SALES_HOURLY (HOUR, ORDERS, QTY, REVENUE)
+            VALUES (SUBSTR(NEW.DATE, 1, 13), 1, 0, NEW.TOTAL)
+            ON CONFLICT (HOUR) DO UPDATE SET ORDERS = ORDERS + 1, REVENUE = REVENUE + excluded.REVENUE;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_SALES_ORDER_DELETE AFTER DELETE ON ORDER_MASTER
+        BEGIN
+            UPDATE SALES_DAILY SET ORDERS = ORDERS - 1, REVENUE = REVENUE - OLD.TOTAL
+            WHERE DAY = SUBSTR(OLD.DATE, 1, 10);
+            UPDATE SALES_HOURLY SET ORDERS = ORDERS - 1, REVENUE = REVENUE - OLD.TOTAL
+            WHERE HOUR = SUBSTR(OLD.DATE, 1, 13);
+        END
+        ''',
+        # 明細：數量與各商品銷售（日期取自主檔，write_order 一定先寫主檔）
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_SALES_DETAIL_INSERT AFTER INSERT ON ORDER_DETAIL
+        BEGIN
+            INSERT INTO SALES_DAILY (DAY, ORDERS, QTY, REVENUE)
+            SELECT SUBSTR(DATE, 1, 10), 0, NEW.QTY, 0 FROM ORDER_MASTER WHERE OID = NEW.OID
+            ON CONFLICT (DAY) DO UPDATE SET QTY = QTY + excluded.QTY;
+            INSERT INTO SALES_HOURLY (HOUR, ORDERS, QTY, REVENUE)
+            SELECT SUBSTR(DATE, 1, 13), 0, NEW.QTY, 0 FROM ORDER_MASTER WHERE OID = NEW.OID
+            ON CONFLICT (HOUR) DO UPDATE SET QTY = QTY + excluded.QTY;
+            INSERT INTO SALES_PRODUCT (DAY, PID, ORDERS, QTY, REVENUE)
+            SELECT SUBSTR(DATE, 1, 10), NEW.PID, 1, NEW.QTY, NEW.SUBTOTAL FROM ORDER_MASTER WHERE OID = NEW.OID
+            ON CONFLICT (DAY, PID) DO UPDATE SET
+                ORDERS = ORDERS + 1, QTY = QTY + excluded.QTY, REVENUE = REVENUE + excluded.REVENUE;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS TR_SALES_DETAIL_DELETE AFTER DELETE ON ORDER_DETAIL
+        BEGIN
+            UPDATE SALES_DAILY SET QTY = QTY - OLD.QTY
+            WHERE DAY = (SELECT SUBSTR(DATE, 1, 10) FROM ORDER_MASTER WHERE OID = OLD.OID);
+            UPDATE SALES_HOURLY SET QTY = QTY - OLD.QTY
+            WHERE HOUR = (SELECT SUBSTR(DATE, 1, 13) FROM ORDER_MASTER WHERE OID = OLD.OID);
+            UPDATE SALES_PRODUCT SET ORDERS = ORDERS - 1, QTY = QTY - OLD.QTY, REVENUE = REVENUE - OLD.SUBTOTAL
+            WHERE DAY = (SELECT SUBSTR(DATE, 1, 10) FROM ORDER_MASTER WHERE OID = OLD.OID) AND PID = OLD.PID;
+        END
+        ''',
+        lambda cur: rebuild_sales_summary(cur),
+    ),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(cur):
+    cur.execute("PRAGMA user_version")
+    return cur.fetchone()[0]
+
+
+def migrate(cur):
+    """把資料庫從目前版本逐版升級到 SCHEMA_VERSION，回傳升級前的版本"""
+    version = get_schema_version(cur)
+    if version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(
+            f"資料庫版本 {version} 比程式支援的 {SCHEMA_VERSION} 新，請更新程式")
+
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        for step in MIGRATIONS[target - 1]:
+            if callable(step):
+                step(cur)
+            else:
+                cur.execute(step)
+        # PRAGMA 不能用參數綁定，target 一定是 int
+        cur.execute(f"PRAGMA user_version = {int(target)}")
+    return version
+
+
+def rebuild_sales_summary(cur):
+    """從 ORDER_MASTER / ORDER_DETAIL 全部重算銷售統計表（須在寫入交易內呼叫）"""
+    for table in ("SALES_DAILY", "SALES_HOURLY", "SALES_PRODUCT"):
+        cur.execute(f"DELETE FROM {table}")
+    for table, key, length in (("SALES_DAILY", "DAY", 10), ("SALES_HOURLY", "HOUR", 13)):
+        cur.execute(f"""
+            INSERT INTO {table} ({key}, ORDERS, QTY, REVENUE)
+            SELECT SUBSTR(M.DATE, 1, {length}), COUNT(*), COALESCE(SUM(D.QTY), 0), SUM(M.TOTAL)
+            FROM ORDER_MASTER M
+            LEFT JOIN (SELECT OID, SUM(QTY) AS QTY FROM ORDER_DETAIL GROUP BY OID) D ON D.OID = M.OID
+            WHERE M.DATE IS NOT NULL
+            GROUP BY 1
+        """)
+    cur.execute("""
+        INSERT INTO SALES_PRODUCT (DAY, PID, ORDERS, QTY, REVENUE)
+        SELECT SUBSTR(M.DATE, 1, 10), D.PID, COUNT(*), SUM(D.QTY), SUM(D.SUBTOTAL)
+        FROM ORDER_DETAIL D
+        JOIN ORDER_MASTER M ON M.OID = D.OID
+        WHERE M.DATE IS NOT NULL
+        GROUP BY 1, 2
+    """)
+
+
+def init_db():
+    """建立 / 升級資料表；整個升級在同一個交易內，失敗就全部還原"""
+    with transaction() as cur:
+        migrate(cur)
+
+# ---------------------------
+# 流水號配發：ID_SEQUENCE 一列一個計數器，UPDATE 一列即可取得新號碼（O(1)）
+def reserve_ids(cur, name, count=1):
+    """在呼叫端的寫入交易內保留 count 個連續號碼，回傳第一個號碼
+
+    必須在 transaction() 內呼叫：計數器的 UPDATE 和後續 INSERT 同一個交易，
+    交易失敗時號碼一起還原；多台終端機同時新增也不會拿到相同號碼。
+    """
+    if count < 1:
+        raise ValueError("count 必須大於 0")
+    cur.execute("UPDATE ID_SEQUENCE SET VALUE = VALUE + ? WHERE NAME = ?", (count, name))
+    if cur.rowcount == 0:
+        cur.execute("INSERT INTO ID_SEQUENCE (NAME, VALUE) VALUES (?, ?)", (name, count))
+        return 1
+    cur.execute("SELECT VALUE FROM ID_SEQUENCE WHERE NAME = ?", (name,))
+    return cur.fetchone()[0] - count + 1
+
+
+def format_pid(num):
+    return f"P{num:06d}"  # P000001, P000002, ...
+
+
+def reserve_pids(cur, count):
+    """批次新增用：一次保留 count 個 PID，回傳 PID list"""
+    first = reserve_ids(cur, "PID", count)
+    return [format_pid(n) for n in range(first, first + count)]
 
-    conn.commit()
-    conn.close()
 
 # 簡化版：全域流水號，從 1 開始，永不重複
-def generate_pid():
-    """產生 PID：P + 6位流水號 (P000001, P000002, ...)"""
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    # 找最大 PID 的流水號
-    cur.execute("SELECT MAX(CAST(SUBSTR(PID, 2) AS INTEGER)) FROM PRODUCT")
-    result = cur.fetchone()[0]
-    
-    next_num = (result or 0) + 1
-    conn.close()
-    
-    return f"P{next_num:06d}"  # P000001, P000002, ...
\ No newline at end of file
+def generate_pid(cur=None):
+    """產生 PID：P + 6位流水號 (P000001, P000002, ...)
+
+    傳入 cur 時在該寫入交易內配發（建議用法）；否則自己開一個短交易。
+    """
+    if cur is None:
+        with transaction() as cur:
+            return format_pid(reserve_ids(cur, "PID"))
+    return format_pid(reserve_ids(cur, "PID"))
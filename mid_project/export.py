@@ -0,0 +1,165 @@
+import os
+import sys
+import csv
+import json
+import argparse
+import datetime
+import db
+from order_store import product_label
+
+# 訂單匯出（CSV / JSONL）：用一條獨立的唯讀連線邊讀邊寫，
+# 不管匯出多大的日期範圍，記憶體都只有一批（CHUNK_ROWS 列）；
+# 不佔用讀取連線池，也不會擋住寫入（WAL 下讀取不鎖寫入），匯出時仍可正常點餐。
+CHUNK_ROWS = 2000
+FORMATS = ("csv", "jsonl")
+
+CSV_COLUMNS = ["訂單編號", "時間", "已完成", "訂單總計", "商品編號", "商品名稱", "數量", "小計"]
+
+
+class ExportCancelled(Exception):
+    """匯出被使用者取消"""
+
+
+def parse_day(text):
+    """'YYYY-MM-DD' -> 同樣格式的字串（格式錯誤丟 ValueError）；空白回傳 None"""
+    text = (text or "").strip()
+    if not text:
+        return None
+    try:
+        return datetime.date.fromisoformat(text).isoformat()
+    except ValueError:
+        raise ValueError(f"日期格式錯誤：{text}（請用 YYYY-MM-DD）") from None
+
+
+def _range(date_from, date_to):
+    """日期（皆含）-> WHERE 條件；DATE 欄位是 'YYYY-MM-DD HH:MM:SS'"""
+    conds, params = [], []
+    if date_from:
+        conds.append("DATE >= ?")
+        params.append(date_from + " 00:00:00")
+    if date_to:
+        end = datetime.date.fromisoformat(date_to) + datetime.timedelta(days=1)
+        conds.append("DATE < ?")
+        params.append(end.isoformat() + " 00:00:00")
+    return (" AND ".join(conds) or "1"), params
+
+
+def _rows(cur, chunk):
+    while True:
+        rows = cur.fetchmany(chunk)
+        if not rows:
+            return
+        yield from rows
+
+
+def export_orders(path, fmt=None, date_from=None, date_to=None, progress=None, cancelled=None,
+                  db_file=None, chunk=CHUNK_ROWS):
+    """把日期範圍內（皆含，'YYYY-MM-DD'）的訂單與明細匯出到 path，回傳匯出的訂單數
+
+    fmt：'csv'（一列一個明細）或 'jsonl'（一行一筆訂單）；None 時依副檔名判斷
+    progress(done, total)：每寫完一批呼叫一次（在匯出的執行緒上）
+    cancelled()：回傳 True 時中止並丟 ExportCancelled，不留下半個檔案
+    商品名稱包含已刪除的商品。先寫到 path.part，完成後才改名成 path。
+    """
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"不支援的匯出格式：{fmt}（可用 {', '.join(FORMATS)}）")
+    date_from, date_to = parse_day(date_from), parse_day(date_to)
+    if date_from and date_to and date_from > date_to:
+        raise ValueError("開始日期不可晚於結束日期！")
+    where, params = _range(date_from, date_to)
+
+    conn = db.get_connection(db_file)
+    conn.execute("PRAGMA query_only = ON")
+    tmp = path + ".part"
+    try:
+        cur = conn.cursor()
+        # 整個匯出在同一個讀取快照內：筆數和內容一致，匯出途中的新訂單不會混進來
+        cur.execute("BEGIN")
+        cur.execute(f"SELECT COUNT(*) FROM ORDER_MASTER WHERE {where}", params)
+        total = cur.fetchone()[0]
+        cur.execute(f"""
+            SELECT M.OID, M.DATE, M.TOTAL, M.COMPLETED, D.PID, P.NAME, D.QTY, D.SUBTOTAL
+            FROM (SELECT * FROM ORDER_MASTER WHERE {where}) M
+            LEFT JOIN ORDER_DETAIL D ON D.OID = M.OID
+            LEFT JOIN PRODUCT P ON P.PID = D.PID
+            ORDER BY M.DATE, M.OID, D.ROWID
+        """, params)
+
+        done = 0
+
+        def step():
+            nonlocal done
+            done += 1
+            if done % chunk == 0:
+                if cancelled and cancelled():
+                    raise ExportCancelled()
+                if progress:
+                    progress(done, total)
+
+        if fmt == "csv":
+            # utf-8-sig：Excel 直接開啟中文不會亂碼
+            with open(tmp, "w", encoding="utf-8-sig", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(CSV_COLUMNS)
+                last_oid = None
+                for oid, date, order_total, completed, pid, name, qty, subtotal in _rows(cur, chunk):
+                    if oid != last_oid:
+                        last_oid = oid
+                        step()
+                    writer.writerow([oid, date, completed, order_total, pid or "",
+                                     product_label(pid, name) if pid else "", qty or "", subtotal or ""])
+        else:
+            with open(tmp, "w", encoding="utf-8") as f:
+                # 依 OID 分組：同一筆訂單的明細是連續的，一次只留一筆訂單在記憶體
+                order = None
+                for oid, date, order_total, completed, pid, name, qty, subtotal in _rows(cur, chunk):
+                    if order is None or order["oid"] != oid:
+                        if order is not None:
+                            f.write(json.dumps(order, ensure_ascii=False) + "\n")
+                            step()
+                        order = {"oid": oid, "date": date, "total": order_total,
+                                 "completed": bool(completed), "items": []}
+                    if pid is not None:
+                        order["items"].append({"pid": pid, "name": product_label(pid, name),
+                                               "qty": qty, "subtotal": subtotal})
+                if order is not None:
+                    f.write(json.dumps(order, ensure_ascii=False) + "\n")
+                    step()
+
+        os.replace(tmp, path)
+        if progress:
+            progress(done, total)
+        return done
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="匯出訂單與明細（CSV / JSONL）")
+    parser.add_argument("path", help="輸出檔（.csv 或 .jsonl）")
+    parser.add_argument("--from", dest="date_from", help="開始日期 YYYY-MM-DD（含）")
+    parser.add_argument("--to", dest="date_to", help="結束日期 YYYY-MM-DD（含）")
+    parser.add_argument("--format", choices=FORMATS, help="預設依副檔名判斷")
+    parser.add_argument("--db", help=f"資料庫檔（預設 {db.DB_FILE}）")
+    args = parser.parse_args(argv)
+
+    def progress(done, total):
+        print(f"\r已匯出 {done}/{total} 筆訂單", end="", file=sys.stderr, flush=True)
+
+    try:
+        count = export_orders(args.path, args.format, args.date_from, args.date_to,
+                              progress=progress, db_file=args.db)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(f"\n完成：{count} 筆訂單 -> {args.path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import datetime
+import threading
+import wx
+from export import export_orders, parse_day, ExportCancelled, FORMATS
+
+
+class ExportDialog(wx.Dialog):
+    """選擇匯出的日期範圍與格式"""
+
+    def __init__(self, parent):
+        super().__init__(parent, title="匯出訂單")
+        today = datetime.date.today()
+
+        grid = wx.FlexGridSizer(3, 2, 10, 10)
+        grid.Add(wx.StaticText(self, label="開始日期"), 0, wx.ALIGN_CENTER_VERTICAL)
+        self.date_from = wx.TextCtrl(self, value=today.replace(day=1).isoformat())
+        grid.Add(self.date_from, 1, wx.EXPAND)
+        grid.Add(wx.StaticText(self, label="結束日期"), 0, wx.ALIGN_CENTER_VERTICAL)
+        self.date_to = wx.TextCtrl(self, value=today.isoformat())
+        grid.Add(self.date_to, 1, wx.EXPAND)
+        grid.Add(wx.StaticText(self, label="格式"), 0, wx.ALIGN_CENTER_VERTICAL)
+        self.format = wx.Choice(self, choices=[f.upper() for f in FORMATS])
+        self.format.SetSelection(0)
+        grid.Add(self.format, 1, wx.EXPAND)
+
+        vbox = wx.BoxSizer(wx.VERTICAL)
+        vbox.Add(wx.StaticText(self, label="日期皆含當天；留白代表不限"), 0, wx.ALL, 10)
+        vbox.Add(grid, 0, wx.EXPAND | wx.LEFT | wx.RIGHT, 10)
+        vbox.Add(self.CreateButtonSizer(wx.OK | wx.CANCEL), 0, wx.EXPAND | wx.ALL, 10)
+        self.SetSizerAndFit(vbox)
+
+    def get_values(self):
+        """回傳 (date_from, date_to, fmt)；日期格式錯誤丟 ValueError"""
+        return (parse_day(self.date_from.GetValue()), parse_day(self.date_to.GetValue()),
+                FORMATS[self.format.GetSelection()])
+
+
+class ExportJob:
+    """在背景執行緒匯出，進度 / 結果透過 wx.CallAfter 回到畫面執行緒"""
+
+    def __init__(self, path, fmt, date_from, date_to, on_progress, on_done):
+        self.path = path
+        self._cancel = threading.Event()
+        self._args = (path, fmt, date_from, date_to)
+        self._on_progress = on_progress      # (done, total)
+        self._on_done = on_done              # (count 或 None, error 訊息或 None)
+        self._thread = threading.Thread(target=self._run, name="pos-export", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def running(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        try:
+            count = export_orders(*self._args,
+                                  progress=lambda done, total: wx.CallAfter(self._on_progress, done, total),
+                                  cancelled=self._cancel.is_set)
+        except ExportCancelled:
+            wx.CallAfter(self._on_done, None, "已取消匯出")
+        except Exception as e:
+            wx.CallAfter(self._on_done, None, f"匯出失敗：{e}")
+        else:
+            wx.CallAfter(self._on_done, count, None)
@@ -1,38 +1,209 @@
+import startup_timing     # 最先 import：開機計時的起點
+import argparse
 import wx
+import services
 from product import ProductPanel
 from order import OrderPanel
 from report import ReportPanel
+import db
 from db import init_db
+from catalog_cache import get_catalog_cache
+import sql_stats
+from export_dialog import ExportDialog, ExportJob
+from ui_loader import run_in_background, get_catalog_sync
+from backup import BackupScheduler
+
+startup_timing.mark("imports")
+
+# 多久檢查一次其他終端機 / 程式是否改過商品（毫秒）；沒有變動時只查一次計數器
+CATALOG_POLL_MS = 2000
+
+
+class LazyPage(wx.Panel):
+    """Notebook 分頁的佔位：第一次切到這一頁才建立真正的畫面並載入資料"""
+
+    def __init__(self, parent, name, factory):
+        super().__init__(parent)
+        self.name = name
+        self.factory = factory    # factory(parent) -> 真正的畫面
+        self.page = None
+        self.SetSizer(wx.BoxSizer(wx.VERTICAL))
+
+    def ensure_built(self):
+        if self.page is None:
+            self.page = self.factory(self)
+            self.GetSizer().Add(self.page, 1, wx.EXPAND)
+            self.Layout()
+            startup_timing.mark(f"page:{self.name}")
+        return self.page
+
 
 class MainFrame(wx.Frame):
     def __init__(self):
         super().__init__(None, title="點餐系統", size=(900, 600))
 
-        # 建立 Notebook
+        # 建立 Notebook：開機只建立點餐頁，其他分頁第一次切過去時才建立
         nb = wx.Notebook(self)
 
-        self.report_panel = ReportPanel(nb)
-        self.order_panel = OrderPanel(nb)       # 先不用傳 report_panel / product_panel
-        self.product_panel = ProductPanel(nb)   # 先不用傳 order_panel
+        # 商品資料在背景載入，視窗先顯示出來
+        self.order_panel = OrderPanel(nb, load=False)
+        self.product_panel = None
+        self.report_panel = None
 
-        # OrderPanel 知道 ReportPanel 和 ProductPanel
-        self.order_panel.report_panel = self.report_panel
-        self.order_panel.product_panel = self.product_panel
+        nb.AddPage(self.order_panel, "點餐")
+        nb.AddPage(LazyPage(nb, "商品", self.build_product_panel), "商品")
+        nb.AddPage(LazyPage(nb, "訂單明細", self.build_report_panel), "訂單明細")
+        nb.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.on_page_changed)
+        self.notebook = nb
 
-        # ProductPanel 知道 OrderPanel
-        self.product_panel.order_panel = self.order_panel
+        # 定期同步商品快取，有變動時由快取通知點餐頁 / 商品頁（商品載入後才開始）
+        self.catalog_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_catalog_timer, self.catalog_timer)
 
-        # 分頁加入 Notebook
-        nb.AddPage(self.order_panel, "點餐")
-        nb.AddPage(self.product_panel, "商品")
-        nb.AddPage(self.report_panel, "訂單明細")
+        # 選單：匯出訂單（伺服器模式下本機沒有資料庫，請在伺服器上執行 export.py）
+        menubar = wx.MenuBar()
+        file_menu = wx.Menu()
+        self.export_item = file_menu.Append(wx.ID_ANY, "匯出訂單...\tCtrl+E")
+        self.cancel_export_item = file_menu.Append(wx.ID_ANY, "取消匯出")
+        self.cancel_export_item.Enable(False)
+        self.export_item.Enable(not services.SERVER_ADDRESS)
+        menubar.Append(file_menu, "檔案")
+        self.SetMenuBar(menubar)
+        self.Bind(wx.EVT_MENU, self.on_export, self.export_item)
+        self.Bind(wx.EVT_MENU, self.on_cancel_export, self.cancel_export_item)
+        self.CreateStatusBar()
+        self.export_job = None
+
+        # 隱藏功能：Ctrl+Shift+F12 輸出 SQL 統計（需設定 POS_SQL_STATS）
+        dump_id = wx.NewIdRef()
+        self.Bind(wx.EVT_MENU, self.on_dump_sql_stats, id=dump_id)
+        self.SetAcceleratorTable(wx.AcceleratorTable([
+            (wx.ACCEL_CTRL | wx.ACCEL_SHIFT, wx.WXK_F12, dump_id),
+        ]))
 
         self.Centre()
         self.Show()
+        startup_timing.mark("frame_shown")
+        self.SetStatusText("載入商品中...")
+        self.load_initial_data()
+
+    # ---------------------------
+    # 分頁：第一次切換到時才建立
+    # ---------------------------
+    def build_product_panel(self, parent):
+        self.product_panel = ProductPanel(parent, order_panel=self.order_panel)
+        self.order_panel.product_panel = self.product_panel
+        return self.product_panel
+
+    def build_report_panel(self, parent):
+        self.report_panel = ReportPanel(parent)
+        # 報表頁建立前送出的訂單不用補：建立時會從資料庫完整載入
+        self.order_panel.report_panel = self.report_panel
+        return self.report_panel
+
+    def on_page_changed(self, event):
+        page = self.notebook.GetPage(event.GetSelection())
+        if isinstance(page, LazyPage):
+            wx.BeginBusyCursor()
+            try:
+                page.ensure_built()
+            finally:
+                wx.EndBusyCursor()
+        event.Skip()
+
+    # ---------------------------
+    # 開機：在背景執行緒讀商品，讀完再回到畫面執行緒建立按鈕
+    # ---------------------------
+    def load_initial_data(self):
+        run_in_background(get_catalog_cache().ensure_loaded, lambda result: self.on_initial_data(None),
+                          on_error=self.on_initial_data, owner=self)
+
+    def on_initial_data(self, error):
+        if error is None:
+            startup_timing.mark("catalog_loaded")
+            self.order_panel.load_products()
+            startup_timing.mark("order_ready")
+            self.SetStatusText("")
+        else:
+            # 讀不到（伺服器斷線等）時由定期同步補上：載入成功後快取會通知點餐頁
+            self.SetStatusText(f"商品載入失敗，稍後自動重試：{error}")
+        self.catalog_timer.Start(CATALOG_POLL_MS)
+
+    # ---------------------------
+    # 匯出：背景執行緒寫檔，進度顯示在狀態列，匯出期間仍可點餐
+    # ---------------------------
+    def on_export(self, event):
+        if self.export_job and self.export_job.running():
+            wx.MessageBox("已有匯出正在進行！", "提示", wx.OK | wx.ICON_INFORMATION)
+            return
+        dlg = ExportDialog(self)
+        try:
+            if dlg.ShowModal() != wx.ID_OK:
+                return
+            try:
+                date_from, date_to, fmt = dlg.get_values()
+            except ValueError as ve:
+                wx.MessageBox(str(ve), "輸入錯誤", wx.OK | wx.ICON_ERROR)
+                return
+        finally:
+            dlg.Destroy()
+
+        name = f"orders_{date_from or 'all'}_{date_to or 'all'}.{fmt}"
+        with wx.FileDialog(self, "匯出到", defaultFile=name, wildcard=f"*.{fmt}|*.{fmt}",
+                           style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT) as fdlg:
+            if fdlg.ShowModal() != wx.ID_OK:
+                return
+            path = fdlg.GetPath()
+
+        self.export_job = ExportJob(path, fmt, date_from, date_to, self.on_export_progress, self.on_export_done)
+        self.cancel_export_item.Enable(True)
+        self.SetStatusText("匯出中...")
+        self.export_job.start()
+
+    def on_cancel_export(self, event):
+        if self.export_job:
+            self.export_job.cancel()
+
+    def on_export_progress(self, done, total):
+        self.SetStatusText(f"匯出中：{done}/{total} 筆訂單")
+
+    def on_export_done(self, count, error):
+        self.cancel_export_item.Enable(False)
+        if error:
+            self.SetStatusText(error)
+            wx.MessageBox(error, "匯出", wx.OK | wx.ICON_WARNING)
+        else:
+            self.SetStatusText(f"匯出完成：{count} 筆訂單")
+            wx.MessageBox(f"已匯出 {count} 筆訂單\n{self.export_job.path}", "匯出", wx.OK | wx.ICON_INFORMATION)
+
+    # ---------------------------
+    def on_dump_sql_stats(self, event):
+        path = sql_stats.dump()
+        if path:
+            wx.MessageBox(f"SQL 統計已寫入 {path}", "SQL 統計", wx.OK | wx.ICON_INFORMATION)
+        else:
+            wx.MessageBox("未啟用 SQL 統計（請設定 POS_SQL_STATS）", "SQL 統計", wx.OK | wx.ICON_INFORMATION)
+
+    def on_catalog_timer(self, event):
+        # 在背景同步；暫時讀不到（伺服器斷線等）就等下一輪
+        get_catalog_sync().request()
 
 
 if __name__ == "__main__":
-    init_db()
+    parser = argparse.ArgumentParser(description="點餐系統")
+    parser.add_argument("--server", help="連到本機訂單伺服器 host:port（或設定 POS_SERVER；未指定時直接使用 pos.db）")
+    parser.add_argument("--db", help=f"資料庫檔（預設 {db.DB_FILE}，或設定 POS_DB）")
+    args = parser.parse_args()
+    if args.server:
+        services.use_server(args.server)
+    if args.db:
+        db.set_db_file(args.db)
+
+    # 伺服器模式由 server.py 負責建立 / 升級資料表與備份
+    if not services.SERVER_ADDRESS:
+        init_db()
+        BackupScheduler().start()
+    startup_timing.mark("db_ready")
     app = wx.App(False)
     frame = MainFrame()
     app.MainLoop()
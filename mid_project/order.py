@@ -1,25 +1,52 @@
 import wx
-import sqlite3
-import datetime
-from db import get_connection
+from services import CartService, order_service
+from catalog_cache import get_catalog_cache
+from ui_refresh import RefreshScheduler
+from product_search import ProductIndex
+from ui_loader import BackgroundLoader, get_catalog_sync
+import startup_timing
 
 class OrderPanel(wx.Panel):
-    def __init__(self, parent, report_panel=None, product_panel=None):
+    def __init__(self, parent, report_panel=None, product_panel=None, load=True):
         super().__init__(parent)
         self.report_panel = report_panel
         self.product_panel = product_panel
 
-        # order_items: list of tuples (pid, name, qty, subtotal)
-        self.order_items = []
+        # 購物車（品項、暫存庫存、商品資訊）由 CartService 管理，送出前不寫 DB
+        # cart.lines: pid -> (pid, name, qty, subtotal)，cart.at(row) 對應 order_list 的列
+        # cart.stock: pid -> current available stock (int)
+        # cart.info:  pid -> (name, price)
+        self.cart = CartService()
+        self.orders = order_service()
+
+        # 商品資料來自全程序共用的快取；其他分頁或終端機改了商品時會通知這裡重畫
+        self.catalog_cache = get_catalog_cache()
+        self.catalog_cache.subscribe(self.on_catalog_changed)
 
-        # product UI state (暫存於 UI，送出前不寫 DB)
         self.product_btns = {}    # pid -> button
-        self.product_stock = {}   # pid -> current available stock (int)
-        self.product_info = {}    # pid -> (name, price)
+        self._btn_state = {}      # pid -> (label, enabled)：按鈕目前顯示的狀態，比對用
+        # 按鈕區的 layout 合併到下一輪事件迴圈做一次
+        self.refresher = RefreshScheduler()
+        # 商品搜尋：只切換按鈕顯示 / 隱藏，不重建按鈕
+        self.search_index = ProductIndex()
+        self._hidden = set()      # 被搜尋條件隱藏的 pid
+        # 商品很多時重建搜尋索引要上百毫秒，放到背景做；商品快取的同步也在背景
+        self.index_loader = BackgroundLoader(owner=self)
+        self.catalog_sync = get_catalog_sync()
 
         main_vbox = wx.BoxSizer(wx.VERTICAL)
 
-        main_vbox.Add(wx.StaticText(self, label="可點餐商品："), 0, wx.LEFT | wx.TOP, 10)
+        h_search = wx.BoxSizer(wx.HORIZONTAL)
+        h_search.Add(wx.StaticText(self, label="可點餐商品："), 0, wx.ALIGN_CENTER_VERTICAL)
+        self.search_box = wx.SearchCtrl(self, style=wx.TE_PROCESS_ENTER)
+        self.search_box.SetDescriptiveText("搜尋名稱 / 編號，輸入快速碼按 Enter 直接點餐")
+        self.search_box.ShowCancelButton(True)
+        h_search.Add(self.search_box, 1, wx.LEFT, 10)
+        main_vbox.Add(h_search, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.TOP, 10)
+
+        self.search_box.Bind(wx.EVT_TEXT, self.on_search)
+        self.search_box.Bind(wx.EVT_TEXT_ENTER, self.on_search_enter)
+        self.search_box.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN, self.on_search_cancel)
 
         # ScrolledWindow for buttons
         self.btn_panel = wx.ScrolledWindow(self, size=(-1, 200))
@@ -65,62 +92,115 @@ class OrderPanel(wx.Panel):
 
         self.SetSizer(main_vbox)
 
-        # 用來快速在 ListCtrl 中找到 pid 對應的 index
-        self.list_index_by_pid = {}  # pid -> list index
-
-        # 初始載入（從 DB 讀取原始庫存）
-        self.load_products()
+        # 初始載入（從 DB 讀取原始庫存）；load=False 時由呼叫端在商品快取載入後再呼叫
+        if load:
+            self.load_products()
 
     # ---------------------------
     def load_products(self):
-        """從 PRODUCT 表載入所有商品（DB -> UI），建立按鈕與暫存庫存"""
-        # 清掉舊的按鈕與暫存結構
-        self.btn_sizer.Clear(True)
-        self.product_btns.clear()
-        self.product_stock.clear()
-        self.product_info.clear()
-
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT PID, NAME, PRICE, STOCK FROM PRODUCT WHERE DELETED = 0")
-        products = cur.fetchall()
-        conn.close()
-
-        for pid, name, price, stock in products:
-            # 建立按鈕時把 DB 的 stock 複製到 self.product_stock（UI 暫存）
-            self.product_stock[pid] = stock
-            self.product_info[pid] = (name, price)
-
-            label = f"{name}\n價格: {price:.2f}\n庫存: {stock}"
-            btn = wx.Button(self.btn_panel, label=label, size=(140, 80))
-            btn.Bind(wx.EVT_BUTTON, lambda evt, p=pid: self.on_product_btn(evt, p))
-            self.btn_sizer.Add(btn, 0, wx.ALL, 5)
-            self.product_btns[pid] = btn
-
-            # 若庫存為 0，Disabled 並變色
-            if stock <= 0:
-                btn.Disable()
-                try:
-                    btn.SetBackgroundColour(wx.Colour(200, 200, 200))
-                except Exception:
-                    pass
+        """從商品快取載入所有商品（快取 -> UI），與現有按鈕比對後只更新有變動的部分
+
+        已存在的按鈕就地更新文字 / 啟用狀態，只新增或移除增減的商品，
+        有增減時才（延後到下一輪事件迴圈）重新 layout 一次。
+        """
+        # 暫存庫存會扣掉購物車已佔用的數量（重新載入時不會把預扣的庫存還回去）
+        products = self.catalog_cache.active()
+        self.cart.load_products(products)
+        self.index_loader.load(lambda cancelled: self.search_index.build(products), self._index_built)
+
+        self.btn_panel.Freeze()
+        try:
+            structure_changed = False
+
+            # 移除已刪除 / 不再販售的商品
+            for pid in [p for p in self.product_btns if p not in self.cart.info]:
+                btn = self.product_btns.pop(pid)
+                self._btn_state.pop(pid, None)
+                self.btn_sizer.Detach(btn)
+                btn.Destroy()
+                structure_changed = True
+
+            # cart.info 依 PID 排序；新商品插在對應位置（通常是最後面）
+            for i, pid in enumerate(self.cart.info):
+                if pid not in self.product_btns:
+                    btn = wx.Button(self.btn_panel, size=(140, 80))
+                    btn.Bind(wx.EVT_BUTTON, lambda evt, p=pid: self.on_product_btn(evt, p))
+                    self.btn_sizer.Insert(i, btn, 0, wx.ALL, 5)
+                    self.product_btns[pid] = btn
+                    structure_changed = True
+                self._apply_button_state(pid)
+
+            if structure_changed:
+                self.refresher.layout(self.btn_panel, fit_inside=True)
+            # 新增的按鈕也要套用目前的搜尋條件
+            self.apply_filter()
+        finally:
+            self.btn_panel.Thaw()
+
+    # ---------------------------
+    # 商品搜尋
+    # ---------------------------
+    def apply_filter(self):
+        """依搜尋框內容顯示 / 隱藏按鈕；只切換狀態有變的按鈕"""
+        matches = self.search_index.search(self.search_box.GetValue())
+        all_pids = set(self.product_btns)
+        hidden = set() if matches is None else all_pids - matches
+        self._hidden &= all_pids
+        to_show = self._hidden - hidden
+        to_hide = hidden - self._hidden
+        if not to_show and not to_hide:
+            return
+        for pid in to_show:
+            self.product_btns[pid].Show()
+        for pid in to_hide:
+            self.product_btns[pid].Hide()
+        self._hidden = hidden
+        self.btn_panel.Scroll(0, 0)
+        self.refresher.layout(self.btn_panel, fit_inside=True)
+
+    def _index_built(self, state):
+        if state is not None:
+            self.search_index.install(state)
+            self.apply_filter()
+
+    def on_search(self, event):
+        self.apply_filter()
+
+    def on_search_cancel(self, event):
+        self.search_box.SetValue("")
+
+    def on_search_enter(self, event):
+        """Enter：快速碼或唯一符合的商品直接加入訂單"""
+        text = self.search_box.GetValue()
+        pid = self.search_index.lookup_code(text)
+        if pid is None:
+            # 只要知道是不是唯一符合，找到第二項就可以停
+            matches = self.search_index.search(text, limit=2) or set()
+            if len(matches) == 1:
+                pid = next(iter(matches))
+        if pid is None or pid not in self.cart.info:
+            wx.Bell()
+            return
+        self.search_box.SetValue("")
+        self.add_item(pid)
 
-        self.btn_panel.Layout()
-        self.btn_panel.FitInside()
+    def on_catalog_changed(self, changed):
+        """商品快取有變動（changed 為變動的 PID 集合）"""
+        self.load_products()
 
     # ---------------------------
     def on_product_btn(self, event, pid):
         """處理按鈕點擊：利用 pid 查暫存資料，再呼叫 add_item"""
-        if pid not in self.product_info:
+        if pid not in self.cart.info:
             wx.MessageBox("找不到商品資訊", "錯誤", wx.OK | wx.ICON_ERROR)
             return
-        name, price = self.product_info[pid]
-        stock = self.product_stock.get(pid, 0)
-        self.add_item(pid, name, price, stock)
+        self.add_item(pid)
 
     # ---------------------------
-    def add_item(self, pid, name, price, stock):
+    def add_item(self, pid):
         """加入訂單（若已存在則合併），但不修改 DB，只更新 UI 暫存庫存"""
+        name, price = self.cart.info[pid]
+        stock = self.cart.stock.get(pid, 0)
         # 庫存為 0 時
         if stock <= 0:
             wx.MessageBox(f"{name} 已售完！", "提示", wx.OK | wx.ICON_WARNING)
@@ -139,53 +219,19 @@ class OrderPanel(wx.Panel):
             dlg.Destroy()
             return
 
-        if qty <= 0:
-            wx.MessageBox("數量必須大於 0！", "錯誤", wx.OK | wx.ICON_ERROR)
-            dlg.Destroy()
-            return
-
-        # 使用 UI 暫存的 stock 檢查（而非 DB）
-        cur_stock = self.product_stock.get(pid, 0)
-        if qty > cur_stock:
-            wx.MessageBox(f"庫存不足！目前僅剩 {cur_stock}。", "錯誤", wx.OK | wx.ICON_ERROR)
+        # 數量 / 庫存檢查與合併相同商品都在 CartService
+        try:
+            idx, (p_pid, p_name, new_qty, new_subtotal), is_new = self.cart.add(pid, qty)
+        except ValueError as ve:
+            wx.MessageBox(str(ve), "錯誤", wx.OK | wx.ICON_ERROR)
             dlg.Destroy()
             return
 
-        # 合併相同商品（若已存在則更新數量與小計）
-        found = False
-        for i, (p_pid, p_name, p_qty, p_subtotal) in enumerate(self.order_items):
-            if p_pid == pid:
-                new_qty = p_qty + qty
-                # 加總後仍需檢查不超過當前 UI 暫存庫存（cur_stock）
-                if new_qty > (cur_stock):
-                    # 注意：cur_stock 表示加入前的暫存，可被當作剩餘數量+已點數量? 
-                    # 但我們已設計 cur_stock 為當前可賣量（未包含 order_items 中已佔的量）
-                    # 更簡潔的做法：cur_stock 是剩餘可用量（已考慮先前扣除），
-                    # 因此 new_qty > (p_qty + cur_stock_before?) 會複雜。
-                    # 我們採用簡單檢查：如果 qty > cur_stock 就會在前面被拒絕，所以此處一般可通過。
-                    pass
-
-                new_subtotal = new_qty * price
-                self.order_items[i] = (pid, name, new_qty, new_subtotal)
-
-                # 更新 ListCtrl（使用 list_index_by_pid 找到正確 index）
-                idx = self.list_index_by_pid.get(pid)
-                if idx is not None:
-                    self.order_list.SetItem(idx, 1, str(new_qty))
-                    self.order_list.SetItem(idx, 2, f"{new_subtotal:.2f}")
-                found = True
-                break
-
-        if not found:
-            subtotal = price * qty
+        if is_new:
             idx = self.order_list.InsertItem(self.order_list.GetItemCount(), name)
-            self.order_list.SetItem(idx, 1, str(qty))
-            self.order_list.SetItem(idx, 2, f"{subtotal:.2f}")
-            self.order_items.append((pid, name, qty, subtotal))
-            self.list_index_by_pid[pid] = idx
+        self.order_list.SetItem(idx, 1, str(new_qty))
+        self.order_list.SetItem(idx, 2, f"{new_subtotal:.2f}")
 
-        # 🔹 更新 UI 暫存庫存（減掉剛剛加入的 qty）
-        self.product_stock[pid] = cur_stock - qty
         self._refresh_product_button(pid)
 
         # 更新總金額顯示
@@ -195,50 +241,52 @@ class OrderPanel(wx.Panel):
 
     # ---------------------------
     def _refresh_product_button(self, pid):
-        """根據 self.product_stock 更新該按鈕的 label/狀態（灰化或顯示庫存）"""
+        """根據 self.cart.stock 更新該按鈕的 label/狀態（灰化或顯示庫存）"""
         if pid not in self.product_btns:
             return
-        btn = self.product_btns[pid]
-        name, price = self.product_info[pid]
-        stock = self.product_stock.get(pid, 0)
-        # 更新按鈕文字
-        new_label = f"{name}\n價格: {price:.2f}\n庫存: {stock}"
-        try:
-            btn.SetLabel(new_label)
-        except Exception:
-            # 某些平台上 SetLabel 可能需要其他處理
-            pass
+        if self._apply_button_state(pid):
+            # 不立即 layout：同一輪事件內多個按鈕變動只重排一次
+            self.refresher.layout(self.btn_panel, fit_inside=True)
 
-        # 若庫存剩 0，disable 並變色
-        if stock <= 0:
-            try:
-                btn.Disable()
-                btn.SetBackgroundColour(wx.Colour(200, 200, 200))
-            except Exception:
-                pass
-        else:
-            # 若先前被禁用、現在仍有庫存，確保按鈕啟用並恢復預設顏色
+    def _apply_button_state(self, pid):
+        """把按鈕文字與啟用狀態設成目前的暫存庫存；和上次相同就不動 widget"""
+        btn = self.product_btns[pid]
+        name, price = self.cart.info[pid]
+        stock = self.cart.stock.get(pid, 0)
+        state = (f"{name}\n價格: {price:.2f}\n庫存: {stock}", stock > 0)
+        old = self._btn_state.get(pid)
+        if state == old:
+            return False
+        self._btn_state[pid] = state
+
+        new_label, enabled = state
+        if old is None or old[0] != new_label:
             try:
-                btn.Enable()
-                btn.SetBackgroundColour(wx.NullColour)
+                btn.SetLabel(new_label)
             except Exception:
+                # 某些平台上 SetLabel 可能需要其他處理
                 pass
 
-        # 重新 layout
-        self.btn_panel.Layout()
-        self.btn_panel.FitInside()
+        if old is None or old[1] != enabled:
+            if not enabled:
+                # 若庫存剩 0，disable 並變色
+                try:
+                    btn.Disable()
+                    btn.SetBackgroundColour(wx.Colour(200, 200, 200))
+                except Exception:
+                    pass
+            else:
+                # 若先前被禁用、現在仍有庫存，確保按鈕啟用並恢復預設顏色
+                try:
+                    btn.Enable()
+                    btn.SetBackgroundColour(wx.NullColour)
+                except Exception:
+                    pass
+        return True
 
     # ---------------------------
     def update_total(self):
-        total = sum(item[3] for item in self.order_items)
-        self.total_label.SetLabel(f"總金額：${total:.2f}")
-
-        # ---------------------------
-    def rebuild_list_index(self):
-        """重新建立 pid -> list index 映射（呼叫在 order_items 變動後）"""
-        self.list_index_by_pid.clear()
-        for idx, (pid, name, qty, subtotal) in enumerate(self.order_items):
-            self.list_index_by_pid[pid] = idx
+        self.total_label.SetLabel(f"總金額：${self.cart.total():.2f}")
 
     # ---------------------------
     def get_selected_index(self):
@@ -256,28 +304,23 @@ class OrderPanel(wx.Panel):
 
     # ---------------------------
     def on_delete_selected(self, event):
-        """刪除 ListCtrl 選取項目，並把數量回補至 product_stock，更新按鈕與總金額"""
+        """刪除 ListCtrl 選取項目，並把數量回補至暫存庫存，更新按鈕與總金額"""
         sel = self.get_selected_index()
         if sel is None:
             wx.MessageBox("請先選取要刪除的項目！", "提示", wx.OK | wx.ICON_INFORMATION)
             return
 
         # 取得資料
-        pid, name, qty, subtotal = self.order_items[sel]
+        pid, name, qty, subtotal = self.cart.at(sel)
 
         confirm = wx.MessageBox(f"確定要刪除 {name}（數量：{qty}）？", "確認", wx.YES_NO | wx.ICON_QUESTION)
         if confirm != wx.YES:
             return
 
-        # 回補 UI 暫存庫存
-        self.product_stock[pid] = self.product_stock.get(pid, 0) + qty
-        # 刪除 order_items 與 ListCtrl
-        self.order_items.pop(sel)
+        # 回補暫存庫存並刪除品項，再刪 ListCtrl 對應列
+        self.cart.remove(pid)
         self.order_list.DeleteItem(sel)
 
-        # 重新建立索引映射
-        self.rebuild_list_index()
-
         # 更新按鈕顯示（恢復或更新庫存）
         self._refresh_product_button(pid)
 
@@ -286,18 +329,16 @@ class OrderPanel(wx.Panel):
 
     # ---------------------------
     def on_modify_selected(self, event):
-        """修改選取項目的數量：檢查上限、更新 order_items、調整 product_stock、更新 UI"""
+        """修改選取項目的數量：檢查上限、更新購物車與暫存庫存、更新 UI"""
         sel = self.get_selected_index()
         if sel is None:
             wx.MessageBox("請先選取要修改的項目！", "提示", wx.OK | wx.ICON_INFORMATION)
             return
 
-        pid, name, old_qty, old_subtotal = self.order_items[sel]
-        price = self.product_info[pid][1]
+        pid, name, old_qty, old_subtotal = self.cart.at(sel)
 
-        # 計算可用上限：目前 UI 暫存庫存 + 該筆原有數量
-        # product_stock 設計為「尚未被占用的剩餘量」
-        available = self.product_stock.get(pid, 0) + old_qty
+        # 可用上限：目前 UI 暫存庫存 + 該筆原有數量
+        available = self.cart.available(pid)
 
         dlg = wx.TextEntryDialog(self, f"修改 {name} 數量（可用：{available}）：", "修改數量", str(old_qty))
         if dlg.ShowModal() != wx.ID_OK:
@@ -311,30 +352,16 @@ class OrderPanel(wx.Panel):
             dlg.Destroy()
             return
 
-        if new_qty <= 0:
-            wx.MessageBox("數量必須大於 0（若要移除請使用刪除）！", "錯誤", wx.OK | wx.ICON_ERROR)
-            dlg.Destroy()
-            return
-
-        if new_qty > available:
-            wx.MessageBox(f"庫存不足！最多可設為 {available}。", "錯誤", wx.OK | wx.ICON_ERROR)
+        try:
+            idx, (p_pid, p_name, new_qty, new_subtotal) = self.cart.set_qty(pid, new_qty)
+        except ValueError as ve:
+            wx.MessageBox(str(ve), "錯誤", wx.OK | wx.ICON_ERROR)
             dlg.Destroy()
             return
 
-        # 計算差值：如果 new_qty > old_qty 則需扣更多暫存庫存
-        delta = new_qty - old_qty
-
-        # 調整 product_stock（因為 product_stock 是剩餘量）
-        # 當 delta > 0: 減少 product_stock； delta < 0: 回補 product_stock
-        self.product_stock[pid] = self.product_stock.get(pid, 0) - delta
-
-        # 更新 order_items
-        new_subtotal = new_qty * price
-        self.order_items[sel] = (pid, name, new_qty, new_subtotal)
-
         # 更新 ListCtrl 顯示
-        self.order_list.SetItem(sel, 1, str(new_qty))
-        self.order_list.SetItem(sel, 2, f"{new_subtotal:.2f}")
+        self.order_list.SetItem(idx, 1, str(new_qty))
+        self.order_list.SetItem(idx, 2, f"{new_subtotal:.2f}")
 
         # 更新按鈕顯示
         self._refresh_product_button(pid)
@@ -347,56 +374,38 @@ class OrderPanel(wx.Panel):
 
     # ---------------------------
     def submit_order(self, event):
-        if not self.order_items:
-            wx.MessageBox("請先加入商品！", "提示", wx.OK | wx.ICON_WARNING)
+        # 主檔、明細、扣庫存在同一個交易；任何一項庫存不足整筆都不會寫入
+        try:
+            result = self.orders.submit(self.cart)
+        except ValueError as ve:
+            wx.MessageBox(str(ve), "提示", wx.OK | wx.ICON_WARNING)
             return
 
-        oid = "O" + datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        total = sum(item[3] for item in self.order_items)
-
-        conn = get_connection()
-        cur = conn.cursor()
-        try:
-            # 正確插入：明確欄位，避免欄位數不符
-            cur.execute("""
-                INSERT INTO ORDER_MASTER (OID, DATE, TOTAL, COMPLETED) 
-                VALUES (?, ?, ?, 0)
-            """, (oid, date, total))
-
-            # 明細與庫存更新
-            for pid, name, qty, subtotal in self.order_items:
-                cur.execute("INSERT INTO ORDER_DETAIL (OID, PID, QTY, SUBTOTAL) VALUES (?, ?, ?, ?)", 
-                        (oid, pid, qty, subtotal))
-                cur.execute("UPDATE PRODUCT SET STOCK = STOCK - ? WHERE PID = ?", (qty, pid))
-
-            conn.commit()
-        except sqlite3.Error as e:
-            conn.rollback()
-            wx.MessageBox(f"訂單送出失敗：{e}", "錯誤", wx.OK | wx.ICON_ERROR)
+        if not result.ok:
+            if result.shortages:
+                lines = "\n".join(f"{s.name}：需要 {s.requested}，剩 {s.available}"
+                                  for s in result.shortages)
+                wx.MessageBox(f"庫存不足，訂單未送出：\n{lines}", "錯誤", wx.OK | wx.ICON_ERROR)
+                # 其他終端機可能已賣掉，同步商品快取（有變動時會重畫按鈕，購物車保留）
+                self.catalog_sync.request()
+            else:
+                wx.MessageBox(f"訂單送出失敗：{result.error}", "錯誤", wx.OK | wx.ICON_ERROR)
             return
-        finally:
-            conn.close()
+        oid, total = result.oid, result.total
 
+        startup_timing.first_sale()
         wx.MessageBox(f"訂單 {oid} 已送出！\n總金額 ${total:.2f}", "完成", wx.OK | wx.ICON_INFORMATION)
 
-        # 清空 UI
+        # 清空 UI（購物車已由 OrderService 清空）
         self.order_list.DeleteAllItems()
-        self.order_items.clear()
-        self.list_index_by_pid.clear()
         self.update_total()
 
-        # 重新載入商品（從 DB 取最新庫存）
-        self.load_products()
+        # 同步商品快取：扣過庫存的商品會通知點餐頁與商品頁各自重畫
+        self.catalog_sync.request()
 
-        # 更新報表與商品頁
+        # 更新報表（只附加這一筆，不整個重建）
         if self.report_panel:
             try:
-                self.report_panel.load_order_details()
+                self.report_panel.add_order(oid)
             except Exception:
                 pass
-        if self.product_panel:
-            try:
-                self.product_panel.load_products()
-            except Exception:
-                pass
\ No newline at end of file
@@ -0,0 +1,77 @@
+import os
+import time
+import datetime
+import threading
+from db import transaction, reserve_ids
+
+# OID 格式：O + 年月日時分秒(14) + 毫秒(3) + 終端機編號(6) + 同毫秒序號(3)
+# 例：O20251107143415123 000001 000（實際沒有空白）
+# 舊格式 O20251107143415 是新格式的前綴，字串排序仍然照時間先後，報表 ORDER BY OID 不受影響
+# 終端機編號每次啟動都配發新的且不循環使用，6 位數足夠用到一百萬次啟動；
+# 最大的編號保留給 bench.py 產生的假訂單
+TERMINAL_DIGITS = 6
+MAX_TERMINAL = 10 ** TERMINAL_DIGITS - 2
+SEQ_DIGITS = 3
+MAX_SEQ = 10 ** SEQ_DIGITS - 1
+
+
+class OrderIdGenerator:
+    """單調遞增、不重複的訂單編號產生器（每秒可產生上千筆）"""
+
+    def __init__(self, terminal_id):
+        if not 0 <= terminal_id <= MAX_TERMINAL:
+            raise ValueError(f"終端機編號必須在 0～{MAX_TERMINAL} 之間：{terminal_id}")
+        self.terminal_id = terminal_id
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._seq = 0
+
+    def next_id(self):
+        """回傳 (oid, datetime)，DATE 欄位請用同一個時間，兩者才會一致"""
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms <= self._last_ms:
+                # 同一毫秒（或系統時間被往回調）：沿用上一個毫秒，序號 +1
+                now_ms = self._last_ms
+                self._seq += 1
+                if self._seq > MAX_SEQ:
+                    # 序號用完就借用下一毫秒，確保永遠遞增
+                    now_ms += 1
+                    self._seq = 0
+            else:
+                self._seq = 0
+            self._last_ms = now_ms
+            seq = self._seq
+
+        secs, ms = divmod(now_ms, 1000)
+        dt = datetime.datetime.fromtimestamp(secs).replace(microsecond=ms * 1000)
+        oid = (f"O{dt:%Y%m%d%H%M%S}{ms:03d}"
+               f"{self.terminal_id:0{TERMINAL_DIGITS}d}{seq:0{SEQ_DIGITS}d}")
+        return oid, dt
+
+
+def get_terminal_id():
+    """終端機編號：優先用環境變數 POS_TERMINAL_ID，否則由資料庫配發一個
+
+    資料庫配發的編號每次啟動加一、不會循環，同一個 pos.db 上同時開啟的每個程式都會拿到不同的編號
+    （用完 MAX_TERMINAL 個時 OrderIdGenerator 會丟 ValueError，而不是繞回去和別的程式相撞）。
+    環境變數由使用者自行確保各終端機不重複。
+    """
+    env = os.environ.get("POS_TERMINAL_ID")
+    if env:
+        return int(env)
+    with transaction() as cur:
+        return reserve_ids(cur, "TERMINAL")
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def next_order_id():
+    """產生下一個訂單編號，回傳 (oid, datetime)"""
+    global _generator
+    with _generator_lock:
+        if _generator is None:
+            _generator = OrderIdGenerator(get_terminal_id())
+    return _generator.next_id()
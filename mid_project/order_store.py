@@ -0,0 +1,433 @@
+import sqlite3
+import datetime
+from bisect import bisect_left, insort
+from collections import namedtuple, OrderedDict
+from db import read_cursor, transaction
+from order_id import next_order_id
+
+# 一筆訂單與其明細；items 與 CartService.items 相同格式：(pid, name, qty, subtotal)
+Order = namedtuple("Order", "oid date total completed items")
+
+# 一頁訂單歷史；next_key 為下一頁的起點 (DATE, OID)，沒有下一頁時為 None
+OrderPage = namedtuple("OrderPage", "orders next_key")
+
+# 送出訂單的結果：ok=False 時看 shortages（庫存不足的品項）或 error（其他資料庫錯誤）
+OrderResult = namedtuple("OrderResult", "ok oid date total shortages error")
+
+# 庫存不足的品項：requested 要買的數量、available 資料庫目前庫存
+Shortage = namedtuple("Shortage", "pid name requested available")
+
+
+def product_label(pid, name):
+    """明細顯示用名稱：PRODUCT 沒有這筆資料時標示為已刪除"""
+    return name if name is not None else f"[已刪除] {pid}"
+
+
+def _group_rows(rows):
+    """把依 OID 排序好的 JOIN 結果逐筆分組成 Order（串流處理，不整批載入）"""
+    current = None
+    for oid, date, total, completed, pid, name, qty, subtotal in rows:
+        if current is None or current.oid != oid:
+            if current is not None:
+                yield current
+            current = Order(oid, date, total, bool(completed), [])
+        # LEFT JOIN：沒有明細的訂單 PID 會是 NULL
+        if pid is not None:
+            current.items.append((pid, product_label(pid, name), qty, subtotal))
+    if current is not None:
+        yield current
+
+
+def _query_orders(where="", params=(), order_by="M.OID"):
+    with read_cursor() as cur:
+        cur.execute(f"""
+            SELECT M.OID, M.DATE, M.TOTAL, M.COMPLETED, D.PID, P.NAME, D.QTY, D.SUBTOTAL
+            FROM ORDER_MASTER M
+            LEFT JOIN ORDER_DETAIL D ON D.OID = M.OID
+            LEFT JOIN PRODUCT P ON P.PID = D.PID
+            {where}
+            ORDER BY {order_by}, D.ROWID
+        """, params)
+        yield from _group_rows(cur)
+
+
+def iter_orders(completed=None, by_status=False):
+    """一次 JOIN 查詢取得訂單 + 明細 + 商品名稱，依 OID 分組逐筆產生 Order
+
+    completed：None 全部、False 只取未完成、True 只取已完成
+    by_status：True 時先列未完成再列已完成（報表左右兩欄用），否則單純依 OID 排序
+    """
+    where = ""
+    params = ()
+    if completed is not None:
+        where = "WHERE M.COMPLETED = ?"
+        params = (1 if completed else 0,)
+    order_by = "M.COMPLETED, M.OID" if by_status else "M.OID"
+    yield from _query_orders(where, params, order_by)
+
+
+def get_order(oid):
+    """取得單一訂單（含明細）；找不到回傳 None"""
+    return next(_query_orders("WHERE M.OID = ?", (oid,)), None)
+
+
+def get_orders(oids):
+    """一次取得多筆訂單（依 OID 排序）"""
+    if not oids:
+        return []
+    placeholders = ",".join("?" * len(oids))
+    return list(_query_orders(f"WHERE M.OID IN ({placeholders})", tuple(oids)))
+
+
+def list_pending():
+    """所有未完成訂單 [(oid, date)]，依 OID 排序"""
+    with read_cursor() as cur:
+        cur.execute("SELECT OID, DATE FROM ORDER_MASTER WHERE COMPLETED = 0 ORDER BY OID")
+        return cur.fetchall()
+
+
+def fetch_order_history(after=None, limit=100, date_from=None, date_to=None,
+                        completed=None, min_total=None, max_total=None):
+    """訂單歷史分頁（新到舊），以 (DATE, OID) 做 keyset 分頁
+
+    after：上一頁回傳的 next_key；第一頁傳 None
+    date_from / date_to：'YYYY-MM-DD HH:MM:SS' 字串，date_from 含、date_to 不含
+    completed：None 全部、True / False 只取已完成 / 未完成
+    min_total / max_total：訂單總金額範圍（皆含）
+
+    不論翻到第幾頁，每頁都只走索引讀 limit 筆，不會像 OFFSET 越翻越慢。
+    """
+    conds = []
+    params = []
+    if completed is not None:
+        conds.append("COMPLETED = ?")
+        params.append(1 if completed else 0)
+    if date_from is not None:
+        conds.append("DATE >= ?")
+        params.append(date_from)
+    if date_to is not None:
+        conds.append("DATE < ?")
+        params.append(date_to)
+    if min_total is not None:
+        conds.append("TOTAL >= ?")
+        params.append(min_total)
+    if max_total is not None:
+        conds.append("TOTAL <= ?")
+        params.append(max_total)
+    if after is not None:
+        conds.append("(DATE, OID) < (?, ?)")
+        params.extend(after)
+    where = ("WHERE " + " AND ".join(conds)) if conds else ""
+    params.append(limit)
+
+    orders = list(_query_orders(
+        f"""WHERE M.OID IN (
+                SELECT OID FROM ORDER_MASTER {where}
+                ORDER BY DATE DESC, OID DESC LIMIT ?
+            )""",
+        tuple(params),
+        "M.DATE DESC, M.OID DESC",
+    ))
+    next_key = (orders[-1].date, orders[-1].oid) if len(orders) == limit else None
+    return OrderPage(orders, next_key)
+
+
+# ---------------------------
+# 訂單寫入
+# ---------------------------
+class InsufficientStock(sqlite3.Error):
+    """交易內扣庫存時有品項不夠，用來觸發整筆 ROLLBACK"""
+
+
+def write_order(cur, oid, date, total, items):
+    """在呼叫端的寫入交易內寫入一筆訂單並扣庫存
+
+    扣庫存帶 STOCK >= ? 條件：多台終端機同時賣同一商品也不會扣成負數。
+    任何一項扣不到就丟 InsufficientStock，整筆訂單由外層交易還原。
+    """
+    cur.execute("""
+        INSERT INTO ORDER_MASTER (OID, DATE, TOTAL, COMPLETED)
+        VALUES (?, ?, ?, 0)
+    """, (oid, date, total))
+    cur.executemany(
+        "INSERT INTO ORDER_DETAIL (OID, PID, QTY, SUBTOTAL) VALUES (?, ?, ?, ?)",
+        [(oid, pid, qty, subtotal) for pid, name, qty, subtotal in items])
+    cur.executemany(
+        "UPDATE PRODUCT SET STOCK = STOCK - ? WHERE PID = ? AND STOCK >= ?",
+        [(qty, pid, qty) for pid, name, qty, subtotal in items])
+    if cur.rowcount != len(items):
+        raise InsufficientStock(oid)
+
+
+def find_shortages(items):
+    """找出目前資料庫庫存不足的品項（送出失敗後產生提示訊息用）"""
+    pids = [item[0] for item in items]
+    placeholders = ",".join("?" * len(pids))
+    with read_cursor() as cur:
+        cur.execute(f"SELECT PID, STOCK FROM PRODUCT WHERE PID IN ({placeholders})", pids)
+        stock = dict(cur.fetchall())
+    return [Shortage(pid, name, qty, stock.get(pid, 0))
+            for pid, name, qty, subtotal in items if qty > stock.get(pid, 0)]
+
+
+def commit_order(items, pipeline=None):
+    """送出一筆訂單：一個 BEGIN IMMEDIATE 交易內寫主檔、明細並扣庫存
+
+    items：[(pid, name, qty, subtotal), ...]
+    pipeline：傳入 WritePipeline 時和其他寫入合併成一組 COMMIT（group commit），
+              回傳時該組已確實寫入磁碟
+    回傳 OrderResult；庫存不足時 ok=False 並附上 shortages，資料庫完全不變。
+    """
+    oid, now = next_order_id()
+    date = now.strftime("%Y-%m-%d %H:%M:%S")
+    total = sum(item[3] for item in items)
+
+    def job(cur):
+        write_order(cur, oid, date, total, items)
+
+    try:
+        if pipeline is None:
+            with transaction() as cur:
+                job(cur)
+        else:
+            pipeline.run(job)
+    except InsufficientStock:
+        return OrderResult(False, oid, date, total, find_shortages(items), "庫存不足")
+    except sqlite3.Error as e:
+        return OrderResult(False, oid, date, total, [], str(e))
+    return OrderResult(True, oid, date, total, [], None)
+
+
+def today_start():
+    return datetime.date.today().strftime("%Y-%m-%d 00:00:00")
+
+
+def _desc_position(seq, key, keyfunc):
+    """在由大到小排序的 seq 中，找出 key 應插入的位置"""
+    lo, hi = 0, len(seq)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if keyfunc(seq[mid]) > key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class OrderCache:
+    """報表用訂單快取：OID 清單常駐記憶體，訂單內容依畫面需要整頁載入（LRU）
+
+    虛擬清單只會詢問畫面上看得到的列，所以不管有多少歷史訂單，
+    實際載入的明細量只跟視窗高度有關。
+
+    未完成訂單全部列出（依 OID）；已完成訂單新到舊排列，預設只載入今天的，
+    捲到底時再用 load_more_completed() 一頁一頁往前載入。
+    """
+
+    PAGE_SIZE = 100       # 缺資料時一次載入的訂單數
+    MAX_CACHED = 5000     # 最多快取的訂單數，超過就丟掉最久沒用的
+
+    def __init__(self, source):
+        # source：提供 pending() / history() / orders_by_oid() / get() 的訂單服務
+        # （services.OrderService 直接讀檔，remote.RemoteOrderService 走本機伺服器）
+        self.source = source
+        self.generation = 0   # 每次完整重新同步加一；背景載入的結果世代不同就丟掉
+        self.pending = []     # 未完成 OID（依 OID 排序）
+        self.completed = []   # 已載入的已完成 OID（依 DATE, OID 新到舊）
+        self.dates = {}       # oid -> DATE（清單排序用）
+        self.completed_next_key = None   # 下一頁已完成訂單的起點
+        self.has_more_completed = False
+        self._orders = OrderedDict()  # oid -> Order
+
+    # ---------------------------
+    # 讀取（fetch_*）與套用（apply_*）分開：fetch 只讀資料庫、不動快取，可以在背景執行緒執行，
+    # apply 在畫面執行緒把結果放進快取
+    # ---------------------------
+    def fetch_reload(self, cancelled=None):
+        """讀取未完成清單與今天的已完成訂單；cancelled() 為 True 時中途放棄並回傳 None"""
+        since = today_start()
+        pending = list(self.source.pending())
+        orders = []
+        after = None
+        while True:
+            if cancelled is not None and cancelled():
+                return None
+            page = self.source.history(after, self.PAGE_SIZE, date_from=since, completed=True)
+            orders.extend(page.orders)
+            after = page.next_key
+            if after is None:
+                break
+        return since, pending, orders
+
+    def apply_reload(self, data):
+        """套用 fetch_reload() 的結果：清空明細快取並換成新的清單"""
+        since, pending, orders = data
+        self.generation += 1
+        self._orders.clear()
+        self.dates.clear()
+        self.pending = []
+        for oid, date in pending:
+            self.pending.append(oid)
+            self.dates[oid] = date
+
+        self.completed = []
+        self._append_completed(orders)
+        # 今天以前的，等捲到底再載入
+        if self.completed:
+            self.completed_next_key = self._completed_key(self.completed[-1])
+        else:
+            self.completed_next_key = (since, "")
+        self.has_more_completed = True
+
+    def reload(self):
+        """重新讀取未完成清單與今天的已完成訂單，清空明細快取（完整重新同步）"""
+        self.apply_reload(self.fetch_reload())
+
+    def fetch_more_completed(self, after):
+        """從 after（completed_next_key）往前讀一頁已完成訂單"""
+        return self.source.history(after, self.PAGE_SIZE, completed=True)
+
+    def apply_more_completed(self, after, page):
+        """套用 fetch_more_completed() 的結果，回傳新增筆數；讀取後清單已變動（起點不同）時丟掉"""
+        if not self.has_more_completed or after != self.completed_next_key:
+            return 0
+        self._append_completed(page.orders)
+        if page.orders:
+            self.completed_next_key = self._completed_key(page.orders[-1].oid)
+        self.has_more_completed = page.next_key is not None
+        return len(page.orders)
+
+    def load_more_completed(self):
+        """再往前載入一頁已完成訂單，回傳新增筆數"""
+        if not self.has_more_completed:
+            return 0
+        after = self.completed_next_key
+        return self.apply_more_completed(after, self.fetch_more_completed(after))
+
+    def _append_completed(self, orders):
+        for order in orders:
+            self.completed.append(order.oid)
+            self.dates[order.oid] = order.date
+            self._put(order)
+
+    def _completed_key(self, oid):
+        return (self.dates.get(oid) or "", oid)
+
+    def oids(self, completed):
+        return self.completed if completed else self.pending
+
+    def count(self, completed):
+        return len(self.oids(completed))
+
+    def index(self, completed, oid):
+        """OID 在清單中的位置（二分搜尋）；不存在回傳 None"""
+        oids = self.oids(completed)
+        if completed:
+            if oid not in self.dates:
+                return None
+            i = _desc_position(oids, self._completed_key(oid), self._completed_key)
+        else:
+            i = bisect_left(oids, oid)
+        if i < len(oids) and oids[i] == oid:
+            return i
+        return None
+
+    # ---------------------------
+    def _put(self, order):
+        self._orders[order.oid] = order
+        self._orders.move_to_end(order.oid)
+        while len(self._orders) > self.MAX_CACHED:
+            self._orders.popitem(last=False)
+
+    def _load_page(self, oids):
+        for order in self.source.orders_by_oid(oids):
+            self._put(order)
+
+    def peek(self, completed, row):
+        """第 row 列的訂單；不在快取時回傳 None（不讀資料庫）"""
+        oid = self.oids(completed)[row]
+        order = self._orders.get(oid)
+        if order is not None:
+            self._orders.move_to_end(oid)
+        return order
+
+    def page_oids(self, completed, row):
+        """第 row 列所在那一頁的 OID（缺資料時一次載入一整頁）"""
+        oids = self.oids(completed)
+        start = row - row % self.PAGE_SIZE
+        return oids[start:start + self.PAGE_SIZE]
+
+    def fetch_page(self, oids):
+        return self.source.orders_by_oid(oids)
+
+    def apply_page(self, completed, oids, orders):
+        """套用 fetch_page() 的結果；資料庫已經沒有的訂單給空白資料，下次重新同步就會消失"""
+        for order in orders:
+            self._put(order)
+        for oid in oids:
+            if oid not in self._orders:
+                self._put(Order(oid, "", 0.0, completed, []))
+
+    def get(self, completed, row):
+        """取得第 row 列的訂單；不在快取時把同一頁一起載入"""
+        order = self.peek(completed, row)
+        if order is not None:
+            return order
+
+        self._load_page(self.page_oids(completed, row))
+        oid = self.oids(completed)[row]
+        order = self._orders.get(oid)
+        if order is None:
+            # 資料庫已經沒有這筆（被其他程式刪除），先給空白資料，下次重新同步就會消失
+            order = Order(oid, "", 0.0, completed, [])
+        return order
+
+    # ---------------------------
+    # 增量更新
+    # ---------------------------
+    def _insert_completed(self, oid):
+        key = self._completed_key(oid)
+        # 比已載入範圍還舊的訂單不插入，等翻頁時自然會出現
+        if self.has_more_completed and key < self.completed_next_key:
+            return
+        i = _desc_position(self.completed, key, self._completed_key)
+        self.completed.insert(i, oid)
+
+    def add(self, oid):
+        """加入一筆新訂單，回傳 Order（找不到回傳 None）"""
+        return self.insert(self.source.get(oid))
+
+    def insert(self, order):
+        """加入一筆已讀出的訂單（None 不處理），回傳 order"""
+        if order is None:
+            return None
+        oid = order.oid
+        self.dates[oid] = order.date
+        if self.index(order.completed, oid) is None:
+            if order.completed:
+                self._insert_completed(oid)
+            else:
+                insort(self.pending, oid)
+        self._put(order)
+        return order
+
+    def mark_completed(self, oid):
+        """把訂單從未完成移到已完成（只改快取，不寫資料庫）"""
+        i = self.index(False, oid)
+        if i is None:
+            return False
+        del self.pending[i]
+        self._insert_completed(oid)
+        order = self._orders.get(oid)
+        if order is not None:
+            self._orders[oid] = order._replace(completed=True)
+        return True
+
+    def remove(self, oid):
+        """從快取移除一筆訂單（封存 / 刪除時用）"""
+        for completed in (False, True):
+            i = self.index(completed, oid)
+            if i is not None:
+                del self.oids(completed)[i]
+        self.dates.pop(oid, None)
+        self._orders.pop(oid, None)
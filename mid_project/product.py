@@ -1,17 +1,48 @@
 import wx
-from db import generate_pid, get_connection
+from services import catalog_service
+from catalog_cache import get_catalog_cache
+from product_import import load_sheet
+from ui_loader import BackgroundLoader, get_catalog_sync
+
+
+class ProductListCtrl(wx.ListCtrl):
+    """虛擬商品清單：顯示背景整理好的字串列，換資料只要改筆數，不用逐列 Append"""
+
+    COLUMNS = [("商品編號", 100), ("名稱", 150), ("價格", 80), ("庫存", 80)]
+
+    def __init__(self, parent):
+        super().__init__(parent, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL)
+        self.rows = []    # [(pid, name, price, stock)] 皆為字串
+        for i, (label, width) in enumerate(self.COLUMNS):
+            self.InsertColumn(i, label, width=width)
+
+    def set_rows(self, rows):
+        # 列號會對到別的商品，取消原本的選取
+        selected = self.GetFirstSelected()
+        if selected >= 0:
+            self.Select(selected, False)
+        self.rows = rows
+        self.SetItemCount(len(rows))
+        self.Refresh()
+
+    def OnGetItemText(self, row, col):
+        return self.rows[row][col]
+
 
 class ProductPanel(wx.Panel):
     def __init__(self, parent, order_panel=None):
         super().__init__(parent)
         self.order_panel = order_panel
+        self.catalog = catalog_service()
+        self.catalog_cache = get_catalog_cache()
+        self.catalog_cache.subscribe(self.on_catalog_changed)
+        self.catalog_sync = get_catalog_sync()
+        self.loader = BackgroundLoader(owner=self)
 
         vbox = wx.BoxSizer(wx.VERTICAL)
 
         # ---- 商品列表 ----
-        self.list = wx.ListCtrl(self, style=wx.LC_REPORT)
-        for i, col in enumerate(["商品編號", "名稱", "價格", "庫存"]):
-            self.list.InsertColumn(i, col, width=150)
+        self.list = ProductListCtrl(self)
         vbox.Add(self.list, 1, wx.ALL | wx.EXPAND, 10)
 
         
@@ -33,10 +64,12 @@ class ProductPanel(wx.Panel):
         add_btn = wx.Button(self, label="新增")
         update_btn = wx.Button(self, label="修改")
         delete_btn = wx.Button(self, label="刪除")
+        import_btn = wx.Button(self, label="批次匯入...")
 
         hbox.Add(add_btn, 0, wx.ALL, 5)
         hbox.Add(update_btn, 0, wx.ALL, 5)
         hbox.Add(delete_btn, 0, wx.ALL, 5)
+        hbox.Add(import_btn, 0, wx.ALL, 5)
         vbox.Add(hbox, 0, wx.CENTER)
 
         self.SetSizer(vbox)
@@ -44,14 +77,12 @@ class ProductPanel(wx.Panel):
         # 隱藏 PID 輸入框（或設為唯讀）
         self.inputs["商品編號"].Disable()  # 不可編輯
         self.inputs["商品編號"].SetValue("自動產生")
-        
-        # 綁定事件後
-        self.load_products()
 
         # 綁定事件
         add_btn.Bind(wx.EVT_BUTTON, self.on_add)
         update_btn.Bind(wx.EVT_BUTTON, self.on_update)
         delete_btn.Bind(wx.EVT_BUTTON, self.on_delete)
+        import_btn.Bind(wx.EVT_BUTTON, self.on_import)
         self.list.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_item_selected)
 
         self.load_products()
@@ -65,33 +96,12 @@ class ProductPanel(wx.Panel):
             price = float(self.inputs["價格"].GetValue().strip())
             stock = int(self.inputs["庫存"].GetValue().strip())
 
-            if not name:
-                raise ValueError("名稱不可為空！")
-            if price < 0 or stock < 0:
-                raise ValueError("價格與庫存不可為負數！")
-
-            # 自動產生 PID
-            pid = generate_pid()
-
-            conn = get_connection()
-            cur = conn.cursor()
-            
-            # 檢查名稱重複
-            cur.execute("SELECT 1 FROM PRODUCT WHERE NAME = ? AND DELETED = 0", (name,))
-            if cur.fetchone():
-                raise ValueError("商品名稱已存在！")
-
-            cur.execute("""
-                INSERT INTO PRODUCT (PID, NAME, PRICE, STOCK, DELETED) 
-                VALUES (?, ?, ?, ?, 0)
-            """, (pid, name, price, stock))
-            conn.commit()
-            conn.close()
+            # 驗證、名稱重複檢查與自動產生 PID 都在 CatalogService
+            pid = self.catalog.add_product(name, price, stock)
 
             wx.MessageBox(f"商品已新增\n編號：{pid}", "完成", wx.OK | wx.ICON_INFORMATION)
-            self.load_products()
-            if self.order_panel:
-                self.order_panel.load_products()
+            # 同步快取後由快取通知商品頁與點餐頁重畫
+            self.catalog_sync.request()
 
             # 清空輸入（PID 保持自動）
             self.inputs["名稱"].SetValue("")
@@ -113,32 +123,13 @@ class ProductPanel(wx.Panel):
             price = float(self.inputs["價格"].GetValue().strip())
             stock = int(self.inputs["庫存"].GetValue().strip())
 
-            if not pid or pid == "自動產生":
+            if pid == "自動產生":
                 raise ValueError("請先選擇要修改的商品！")
-            if not name:
-                raise ValueError("名稱不可為空！")
-            if price < 0 or stock < 0:
-                raise ValueError("價格與庫存不可為負數！")
-
-            conn = get_connection()
-            cur = conn.cursor()
-
-            # 確認商品存在
-            cur.execute("SELECT * FROM PRODUCT WHERE PID = ? AND DELETED = 0", (pid,))
-            if not cur.fetchone():
-                raise ValueError("找不到該商品編號！")
-
-            cur.execute("""
-                UPDATE PRODUCT SET NAME = ?, PRICE = ?, STOCK = ? 
-                WHERE PID = ? AND DELETED = 0
-            """, (name, price, stock, pid))
-            conn.commit()
-            conn.close()
+
+            self.catalog.update_product(pid, name, price, stock)
 
             wx.MessageBox("商品資料已更新", "完成", wx.OK | wx.ICON_INFORMATION)
-            self.load_products()
-            if self.order_panel:
-                self.order_panel.load_products()
+            self.catalog_sync.request()
 
         except ValueError as ve:
             wx.MessageBox(str(ve), "輸入錯誤", wx.OK | wx.ICON_ERROR)
@@ -159,18 +150,10 @@ class ProductPanel(wx.Panel):
             return
 
         try:
-            conn = get_connection()
-            cur = conn.cursor()
-            # 錯誤修正：
-            cur.execute("UPDATE PRODUCT SET DELETED = 1 WHERE PID = ?", (pid,))
-            conn.commit()
-            conn.close()
+            self.catalog.delete_product(pid)
 
             wx.MessageBox("商品已刪除", "完成", wx.OK | wx.ICON_INFORMATION)
-            self.load_products()
-
-            if self.order_panel:
-                self.order_panel.load_products()
+            self.catalog_sync.request()
 
             for txt in self.inputs.values():
                 txt.SetValue("")
@@ -178,6 +161,46 @@ class ProductPanel(wx.Panel):
         except Exception as e:
             wx.MessageBox(f"刪除商品時發生錯誤：{e}", "錯誤", wx.OK | wx.ICON_ERROR)
 
+    # ---------------------------------------------------------
+    # 批次匯入（CSV / JSONL 商品表）
+    # ---------------------------------------------------------
+    def on_import(self, event):
+        with wx.FileDialog(self, "選擇商品表", wildcard="商品表 (*.csv;*.jsonl)|*.csv;*.jsonl",
+                           style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST) as dlg:
+            if dlg.ShowModal() != wx.ID_OK:
+                return
+            path = dlg.GetPath()
+
+        try:
+            # 整份先檢查，有錯誤就一筆都不寫
+            products = load_sheet(path)
+        except ValueError as ve:
+            wx.MessageBox(str(ve), "輸入錯誤", wx.OK | wx.ICON_ERROR)
+            return
+        except OSError as e:
+            wx.MessageBox(f"無法讀取檔案：{e}", "錯誤", wx.OK | wx.ICON_ERROR)
+            return
+
+        answer = wx.MessageBox(f"即將匯入 {len(products)} 項商品（同名商品會更新價格與庫存）。\n"
+                               f"商品表中沒有的現有商品要一併刪除嗎？",
+                               "批次匯入", wx.YES_NO | wx.CANCEL | wx.ICON_QUESTION)
+        if answer == wx.CANCEL:
+            return
+
+        try:
+            result = self.catalog.import_products(products, delete_missing=(answer == wx.YES))
+        except ValueError as ve:
+            wx.MessageBox(str(ve), "輸入錯誤", wx.OK | wx.ICON_ERROR)
+            return
+        except Exception as e:
+            wx.MessageBox(f"匯入商品時發生錯誤：{e}", "錯誤", wx.OK | wx.ICON_ERROR)
+            return
+
+        wx.MessageBox(f"新增 {result.added}、更新 {result.updated}、未變動 {result.unchanged}、刪除 {result.deleted}",
+                      "匯入完成", wx.OK | wx.ICON_INFORMATION)
+        # 整批只同步一次快取
+        self.catalog_sync.request()
+
     # ---------------------------------------------------------
     # 點擊商品 → 顯示資料到輸入框
     # ---------------------------------------------------------
@@ -192,24 +215,14 @@ class ProductPanel(wx.Panel):
     # ---------------------------------------------------------
     # 載入商品資料
     # ---------------------------------------------------------
+    def on_catalog_changed(self, changed):
+        self.load_products()
+
     def load_products(self):
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        # 選 PID, NAME, PRICE, STOCK（不選 DELETED）
-        cur.execute("SELECT PID, NAME, PRICE, STOCK FROM PRODUCT WHERE DELETED = 0")
-        rows = cur.fetchall()
-        conn.close()
-
-        self.list.DeleteAllItems()
-        self.list.DeleteAllColumns()  # 建議清空，避免欄位錯亂
-
-        # 設定欄位（4 欄，對應 PID, 名稱, 價格, 庫存）
-        self.list.InsertColumn(0, "商品編號", width=100)
-        self.list.InsertColumn(1, "名稱", width=150)
-        self.list.InsertColumn(2, "價格", width=80)
-        self.list.InsertColumn(3, "庫存", width=80)
-
-        # 加入資料
-        for pid, name, price, stock in rows:
-            self.list.Append([pid, name, f"{price:.2f}", str(stock)])
+        """在背景取出商品並整理成字串，回到畫面執行緒再換上；連續變動只套用最後一次"""
+        self.loader.load(self._fetch_rows, self.list.set_rows)
+
+    def _fetch_rows(self, cancelled):
+        # PID, NAME, PRICE, STOCK（不含已刪除），來自共用的商品快取
+        return [(pid, name, f"{price:.2f}", str(stock))
+                for pid, name, price, stock in self.catalog_cache.active()]
@@ -0,0 +1,121 @@
+import os
+import sys
+import csv
+import json
+import math
+import argparse
+
+# 商品批次匯入：讀 CSV / JSONL 商品表，整份檢查過沒有錯誤才寫入
+# 欄位（中英文標題皆可）：名稱 / name、價格 / price、庫存 / stock
+COLUMN_ALIASES = {
+    "name": ("名稱", "商品名稱", "name", "NAME"),
+    "price": ("價格", "售價", "price", "PRICE"),
+    "stock": ("庫存", "stock", "STOCK"),
+}
+MAX_ERRORS = 20     # 錯誤訊息最多列出幾行
+
+
+def _pick(record, field):
+    for key in COLUMN_ALIASES[field]:
+        if key in record:
+            return record[key]
+    return None
+
+
+def read_sheet(path):
+    """讀取商品表，回傳 [(行號, {欄位: 值})]；不支援的格式丟 ValueError"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        # utf-8-sig：Excel 存出來的 CSV 開頭會有 BOM
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            return [(i, row) for i, row in enumerate(csv.DictReader(f), start=2)]
+    if ext in (".jsonl", ".json"):
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for i, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append((i, json.loads(line)))
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"第 {i} 行不是正確的 JSON：{e}") from None
+        return records
+    raise ValueError(f"不支援的檔案格式：{ext or path}（請用 .csv 或 .jsonl）")
+
+
+def validate(records):
+    """檢查整份商品表，回傳 [(name, price, stock)]；有任何錯誤就丟 ValueError 列出所有問題"""
+    products = []
+    errors = []
+    seen = {}
+    for line, record in records:
+        # JSONL 每一行都要是物件（{"名稱": ..., "價格": ..., "庫存": ...}）
+        if not isinstance(record, dict):
+            errors.append(f"第 {line} 行：必須是 JSON 物件")
+            continue
+        name = str(_pick(record, "name") or "").strip()
+        price = _pick(record, "price")
+        stock = _pick(record, "stock")
+        try:
+            if not name:
+                raise ValueError("名稱不可為空！")
+            if name in seen:
+                raise ValueError(f"名稱「{name}」與第 {seen[name]} 行重複！")
+            try:
+                # JSONL 的 true / false 是 bool（int 的子類別），不當成數字
+                if isinstance(price, bool) or isinstance(stock, bool):
+                    raise TypeError
+                price = float(price)
+                stock = int(str(stock).strip()) if not isinstance(stock, int) else stock
+            except (TypeError, ValueError):
+                raise ValueError("價格必須是數字、庫存必須是整數！") from None
+            # float() 接受 "nan" / "inf"：NaN 存進 SQLite 會變成 NULL，點餐頁顯示價格時會出錯
+            if not math.isfinite(price):
+                raise ValueError("價格必須是有限的數字！")
+            if price < 0 or stock < 0:
+                raise ValueError("價格與庫存不可為負數！")
+        except ValueError as e:
+            errors.append(f"第 {line} 行：{e}")
+            continue
+        seen[name] = line
+        products.append((name, price, stock))
+
+    if errors:
+        more = f"\n...（共 {len(errors)} 個錯誤）" if len(errors) > MAX_ERRORS else ""
+        raise ValueError("商品表有錯誤，未匯入任何資料：\n" + "\n".join(errors[:MAX_ERRORS]) + more)
+    if not products:
+        raise ValueError("商品表沒有任何商品！")
+    return products
+
+
+def load_sheet(path):
+    """讀取並檢查商品表，回傳 [(name, price, stock)]"""
+    return validate(read_sheet(path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批次匯入 / 更新商品（CSV / JSONL）")
+    parser.add_argument("path", help="商品表（欄位：名稱、價格、庫存）")
+    parser.add_argument("--delete-missing", action="store_true", help="刪除商品表中沒有的現有商品")
+    parser.add_argument("--server", help="透過訂單伺服器匯入 host:port")
+    args = parser.parse_args(argv)
+
+    import services
+    from db import init_db
+    if args.server:
+        services.use_server(args.server)
+    else:
+        init_db()
+
+    try:
+        products = load_sheet(args.path)
+        result = services.catalog_service().import_products(products, args.delete_missing)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(f"新增 {result.added}、更新 {result.updated}、未變動 {result.unchanged}、刪除 {result.deleted}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
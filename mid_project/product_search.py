@@ -0,0 +1,82 @@
+from bisect import bisect_left
+
+# 點餐頁的商品搜尋：名稱 / PID 的子字串比對 + 數字快速碼
+#
+# 把每個名稱與 PID 的所有後綴排序後放在 list 中，任何子字串都是某個後綴的前綴，
+# 用 bisect 找出前綴範圍即可，每次按鍵只需 O(log n + 命中數)，不必逐一比對全部商品。
+# 一個字的查詢（例如 "p" 是每個 PID 的開頭）會命中幾乎全部商品，一萬項商品時約要數毫秒；
+# 只需要知道是否唯一符合時（Enter）用 limit 提早停止。
+# 快速碼就是 PID 的流水號（P000123 -> 123），熟悉菜單的店員輸入數字按 Enter 即可點餐；
+# 數字一樣會比對名稱 / PID，快速碼本身用 dict 查表（lookup_code）。
+
+
+def normalize(text):
+    return "".join(str(text).split()).casefold()
+
+
+def quick_code(pid):
+    """PID 的數字快速碼（P000123 -> 123）；格式不符回傳 None"""
+    digits = pid[1:]
+    return int(digits) if digits.isdigit() else None
+
+
+class ProductIndex:
+    """商品搜尋索引；商品名稱 / PID 有變動時才重建（庫存變動不影響）"""
+
+    def __init__(self):
+        self._names = {}     # pid -> name（目前索引的內容）
+        self._codes = {}     # 快速碼 -> pid
+        self._suffixes = []  # 排序好的 (後綴, pid)
+
+    def update(self, products):
+        """products：[(pid, name, ...)] 未刪除商品；回傳是否重建了索引"""
+        state = self.build(products)
+        if state is None:
+            return False
+        self.install(state)
+        return True
+
+    def build(self, products):
+        """建立新的索引內容但不套用（可在背景執行緒呼叫）；名稱 / PID 都沒變時回傳 None"""
+        names = {p[0]: p[1] for p in products}
+        if names == self._names:
+            return None
+        codes = {}
+        suffixes = []
+        for pid, name in names.items():
+            code = quick_code(pid)
+            if code is not None:
+                codes[code] = pid
+            for key in {normalize(name), normalize(pid)}:
+                suffixes.extend((key[i:], pid) for i in range(len(key)))
+        suffixes.sort()
+        return names, codes, suffixes
+
+    def install(self, state):
+        """套用 build() 的結果"""
+        self._names, self._codes, self._suffixes = state
+
+    def search(self, text, limit=None):
+        """名稱或 PID 含有 text 的商品 PID 集合；text 為空白時回傳 None（代表全部）
+
+        limit：找到這麼多項就停止（只需要判斷是否唯一符合時用）
+        """
+        key = normalize(text)
+        if not key:
+            return None
+        # 每項商品都已符合就不必再往下找（"p" 這類查詢）
+        limit = min(limit or len(self._names), len(self._names))
+        matches = set()
+        i = bisect_left(self._suffixes, (key,))
+        suffixes = self._suffixes
+        while i < len(suffixes) and len(matches) != limit and suffixes[i][0].startswith(key):
+            matches.add(suffixes[i][1])
+            i += 1
+        return matches
+
+    def lookup_code(self, text):
+        """輸入的是快速碼時回傳對應的 PID，否則 None"""
+        text = text.strip()
+        if not text.isdigit():
+            return None
+        return self._codes.get(int(text))
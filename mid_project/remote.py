@@ -0,0 +1,231 @@
+import json
+import select
+import socket
+import threading
+from order_store import Order, OrderPage, OrderResult, Shortage
+from sales import DaySummary, SalesTotal, ProductSales
+from services import ImportResult
+
+# 本機訂單伺服器的通訊協定：一行一個 JSON（UTF-8）
+#   請求：{"op": "submit_order", "args": {...}}
+#   回應：{"ok": true, "result": ...} 或 {"ok": false, "type": "ValueError", "error": "訊息"}
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# 只讀的請求：送出後才斷線 / 逾時也可以安全地重送（須和 server.py 的 read_ops 一致）
+# 其他請求（送出訂單、改商品…）一旦送出就不重送，避免伺服器其實已經處理過而重複寫入
+READ_OPS = frozenset({"list_products", "changed_products", "pending_orders", "order_history",
+                      "orders_by_oid", "get_order", "sales_summary"})
+
+
+def parse_address(address):
+    """ "host:port" / "port" / None -> (host, port) """
+    if not address:
+        return DEFAULT_HOST, DEFAULT_PORT
+    host, sep, port = str(address).rpartition(":")
+    return (host or DEFAULT_HOST), int(port)
+
+
+# ---------------------------
+# namedtuple <-> JSON
+# ---------------------------
+def encode_order(order):
+    return None if order is None else order._asdict()
+
+
+def decode_order(data):
+    if data is None:
+        return None
+    data = dict(data)
+    data["items"] = [tuple(item) for item in data["items"]]
+    return Order(**data)
+
+
+def encode_page(page):
+    return {"orders": [encode_order(o) for o in page.orders], "next_key": page.next_key}
+
+
+def decode_page(data):
+    next_key = tuple(data["next_key"]) if data["next_key"] else None
+    return OrderPage([decode_order(o) for o in data["orders"]], next_key)
+
+
+def encode_result(result):
+    data = result._asdict()
+    data["shortages"] = [s._asdict() for s in result.shortages]
+    return data
+
+
+def decode_result(data):
+    data = dict(data)
+    data["shortages"] = [Shortage(**s) for s in data["shortages"]]
+    return OrderResult(**data)
+
+
+def encode_summary(summary):
+    return {
+        "day": summary.day,
+        "total": list(summary.total),
+        "hours": [list(h) for h in summary.hours],
+        "products": [list(p) for p in summary.products],
+    }
+
+
+def decode_summary(data):
+    return DaySummary(data["day"], SalesTotal(*data["total"]),
+                      [SalesTotal(*h) for h in data["hours"]],
+                      [ProductSales(*p) for p in data["products"]])
+
+
+class ServerError(Exception):
+    """伺服器回報的非輸入錯誤（資料庫錯誤、連線中斷等）"""
+
+
+class ServerClient:
+    """連到 server.py 的客戶端：一條長駐連線，多執行緒共用時依序送出"""
+
+    def __init__(self, address=None, timeout=10):
+        self.address = parse_address(address)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._file = None
+
+    def _connect(self):
+        if self._sock is not None:
+            # 閒置中的連線不該有資料可讀；可讀代表伺服器已關閉（重新啟動等），送出前先換一條
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            if not readable:
+                return
+            self._disconnect()
+        self._sock = socket.create_connection(self.address, timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rwb")
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+    def call(self, op, **args):
+        """送出一個請求並等待回應
+
+        送出前連線就失敗時重連一次；已經送出後才斷線 / 逾時，只有 READ_OPS 會重送，
+        寫入類的請求直接丟 ServerError（伺服器可能已經處理過）。
+        """
+        line = json.dumps({"op": op, "args": args}, ensure_ascii=False).encode("utf-8") + b"\n"
+        with self._lock:
+            for attempt in (1, 2):
+                sent = False
+                try:
+                    self._connect()
+                    self._file.write(line)
+                    self._file.flush()
+                    sent = True
+                    reply = self._file.readline()
+                    if not reply:
+                        raise ConnectionError("伺服器已關閉連線")
+                    break
+                except OSError as e:
+                    self._disconnect()
+                    if sent and op not in READ_OPS:
+                        raise ServerError(f"訂單伺服器沒有回應，無法確定是否已處理：{e}") from e
+                    if attempt == 2:
+                        raise ServerError(f"無法連線到訂單伺服器：{e}") from e
+
+        resp = json.loads(reply)
+        if resp["ok"]:
+            return resp["result"]
+        if resp.get("type") == "ValueError":
+            raise ValueError(resp["error"])
+        raise ServerError(resp["error"])
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(address=None):
+    """同一個位址共用一個 ServerClient"""
+    key = parse_address(address)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = ServerClient(address)
+        return _clients[key]
+
+
+# ---------------------------
+# 與 services 相同介面的伺服器版本
+# ---------------------------
+class RemoteCatalogService:
+    """CatalogService 的伺服器版本"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def list_products(self):
+        return [tuple(row) for row in self.client.call("list_products")]
+
+    def changed_products(self, since):
+        version, rows = self.client.call("changed_products", since=since)
+        return version, [tuple(row) for row in rows]
+
+    def add_product(self, name, price, stock):
+        return self.client.call("add_product", name=name, price=price, stock=stock)
+
+    def update_product(self, pid, name, price, stock):
+        self.client.call("update_product", pid=pid, name=name, price=price, stock=stock)
+
+    def delete_product(self, pid):
+        self.client.call("delete_product", pid=pid)
+
+    def import_products(self, products, delete_missing=False):
+        data = self.client.call("import_products", products=[list(p) for p in products],
+                                delete_missing=delete_missing)
+        return ImportResult(*data)
+
+
+class RemoteOrderService:
+    """OrderService 的伺服器版本"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, cart):
+        if not cart.lines:
+            raise ValueError("請先加入商品！")
+        try:
+            data = self.client.call("submit_order", items=cart.items)
+        except ServerError as e:
+            return OrderResult(False, None, None, cart.total(), [], str(e))
+        result = decode_result(data)
+        if result.ok:
+            cart.clear()
+        return result
+
+    def complete(self, oid):
+        return self.client.call("complete_order", oid=oid)
+
+    def pending(self):
+        return [tuple(row) for row in self.client.call("pending_orders")]
+
+    def history(self, after=None, limit=100, **filters):
+        return decode_page(self.client.call("order_history", after=after, limit=limit, **filters))
+
+    def orders_by_oid(self, oids):
+        return [decode_order(o) for o in self.client.call("orders_by_oid", oids=list(oids))]
+
+    def get(self, oid):
+        return decode_order(self.client.call("get_order", oid=oid))
+
+    def sales_summary(self, day=None, top=20):
+        return decode_summary(self.client.call("sales_summary", day=day, top=top))
@@ -1,10 +1,165 @@
+import sqlite3
 import wx
-from db import get_connection
+from services import order_service
+from order_store import OrderCache
+from ui_refresh import RefreshScheduler
+from ui_loader import BackgroundLoader, run_in_background
+from remote import ServerError
+
+# 多久檢查一次其他終端機是否新增 / 完成了訂單（毫秒）；只讀未完成清單，和畫面不同時才完整重新同步
+ORDER_POLL_MS = 5000
+
+
+class OrderListCtrl(wx.ListCtrl):
+    """虛擬訂單清單：只有畫面上看得到的列才會向 OrderCache 取資料
+
+    快取裡沒有的列先顯示「載入中」，整頁在背景讀取後再重畫，捲動時畫面不會卡住。
+    """
+
+    COLUMNS = [("訂單編號", 190), ("時間", 140), ("品項", 260), ("總計", 80)]
+    PREFETCH_ROWS = 20   # 已完成清單捲到剩這麼多列時，就先載入更早的一頁
+
+    def __init__(self, parent, cache, completed, refresher=None):
+        super().__init__(parent, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL)
+        self.cache = cache
+        self.refresher = refresher or RefreshScheduler()
+        self.completed = completed
+        self._loading_more = False
+        self._requested = set()   # 背景載入中的頁：(快取世代, 該頁第一個 OID)
+        for i, (label, width) in enumerate(self.COLUMNS):
+            self.InsertColumn(i, label, width=width)
+
+    def refresh_rows(self):
+        """筆數變動後呼叫：只更新總筆數，內容等重畫時再取"""
+        # 列數要立即和快取一致（HitTest / OnGetItemText 依列號取資料），重畫則合併到下一輪
+        count = self.cache.count(self.completed)
+        if count != self.GetItemCount():
+            self.SetItemCount(count)
+        self.refresher.refresh(self)
+
+    def _load_more(self):
+        """在背景讀更早的一頁已完成訂單"""
+        after = self.cache.completed_next_key
+        run_in_background(lambda: self.cache.fetch_more_completed(after),
+                          lambda page: self._more_loaded(after, page),
+                          on_error=self._more_failed, owner=self)
+
+    def _more_loaded(self, after, page):
+        self._loading_more = False
+        # 讀取期間重新同步過的話，起點不同，這頁會被丟掉
+        if self.cache.apply_more_completed(after, page):
+            self.refresh_rows()
+
+    def _more_failed(self, error):
+        self._loading_more = False
+
+    def _request_page(self, row):
+        """在背景載入 row 所在的整頁訂單，載入後重畫"""
+        oids = self.cache.page_oids(self.completed, row)
+        generation = self.cache.generation
+        key = (generation, oids[0])
+        if key in self._requested:
+            return
+        self._requested.add(key)
+
+        def loaded(orders):
+            self._requested.discard(key)
+            if self.cache.generation == generation:
+                self.cache.apply_page(self.completed, oids, orders)
+                self.refresher.refresh(self)
+
+        def failed(error):
+            self._requested.discard(key)
+
+        run_in_background(lambda: self.cache.fetch_page(oids), loaded, on_error=failed, owner=self)
+
+    def OnGetItemText(self, row, col):
+        # 快捲到底：在背景載入更早的一頁（重畫途中不能改列數，讀完才改）
+        if (self.completed and not self._loading_more and self.cache.has_more_completed
+                and row >= self.GetItemCount() - self.PREFETCH_ROWS):
+            self._loading_more = True
+            self._load_more()
+        order = self.cache.peek(self.completed, row)
+        if order is None:
+            self._request_page(row)
+            return "載入中..." if col == 0 else ""
+        if col == 0:
+            return order.oid
+        if col == 1:
+            return order.date or ""
+        if col == 2:
+            return "、".join(f"{name} x{qty}" for pid, name, qty, subtotal in order.items)
+        return f"{order.total:.2f}"
+
+
+class SalesSummaryPanel(wx.Panel):
+    """今日銷售摘要：總計、各小時、熱銷商品（讀銷售統計表，不掃訂單明細）"""
+
+    TOP_PRODUCTS = 10
+
+    def __init__(self, parent, orders):
+        super().__init__(parent)
+        self.orders = orders
+        self.loader = BackgroundLoader(owner=self)
+
+        vbox = wx.BoxSizer(wx.VERTICAL)
+        self.total_label = wx.StaticText(self, label="")
+        self.total_label.SetFont(wx.Font(12, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD))
+        vbox.Add(self.total_label, 0, wx.ALL, 5)
+
+        hbox = wx.BoxSizer(wx.HORIZONTAL)
+        self.hour_list = wx.ListCtrl(self, style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
+        for i, (label, width) in enumerate([("時段", 70), ("筆數", 60), ("件數", 60), ("營業額", 100)]):
+            self.hour_list.InsertColumn(i, label, width=width)
+        self.product_list = wx.ListCtrl(self, style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
+        for i, (label, width) in enumerate([("熱銷商品", 200), ("件數", 60), ("營業額", 100)]):
+            self.product_list.InsertColumn(i, label, width=width)
+        hbox.Add(self.hour_list, 1, wx.EXPAND | wx.RIGHT, 5)
+        hbox.Add(self.product_list, 1, wx.EXPAND)
+        vbox.Add(hbox, 1, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 5)
+        self.SetSizer(vbox)
+
+    def refresh(self):
+        """在背景讀取並整理今日摘要；連續呼叫時只套用最後一次"""
+        self.loader.load(lambda cancelled: self.format(self.orders.sales_summary(top=self.TOP_PRODUCTS)),
+                         self.show)
+
+    @staticmethod
+    def format(summary):
+        """DaySummary -> (標題, 各小時的列, 熱銷商品的列)，都是畫面要顯示的字串"""
+        t = summary.total
+        title = f"今日（{summary.day}）：{t.orders} 筆訂單　{t.qty} 件　營業額 ${t.revenue:.2f}"
+        hours = [[f"{h.key[-2:]}:00", str(h.orders), str(h.qty), f"{h.revenue:.2f}"] for h in summary.hours]
+        products = [[p.name, str(p.qty), f"{p.revenue:.2f}"] for p in summary.products]
+        return title, hours, products
+
+    def show(self, rows):
+        title, hours, products = rows
+        self.Freeze()
+        try:
+            self.total_label.SetLabel(title)
+            self.hour_list.DeleteAllItems()
+            for row in hours:
+                self.hour_list.Append(row)
+            self.product_list.DeleteAllItems()
+            for row in products:
+                self.product_list.Append(row)
+        finally:
+            self.Thaw()
+
 
 class ReportPanel(wx.Panel):
     def __init__(self, parent):
         super().__init__(parent)
 
+        # 訂單服務（本機或伺服器）與兩個清單共用的訂單快取
+        self.orders = order_service()
+        self.cache = OrderCache(self.orders)
+        # 兩個清單共用：完成一筆訂單時兩邊的重畫在同一輪處理
+        self.refresher = RefreshScheduler()
+        # 完整重新同步在背景讀取；新的同步開始時，舊的結果直接丟掉
+        self.loader = BackgroundLoader(owner=self)
+
         # __init__ 中，改為左右分割：
 
         splitter = wx.SplitterWindow(self)
@@ -13,15 +168,12 @@ class ReportPanel(wx.Panel):
         left_panel = wx.Panel(splitter)
         left_sizer = wx.BoxSizer(wx.VERTICAL)
 
-        title1 = wx.StaticText(left_panel, label="未完成訂單")
+        title1 = wx.StaticText(left_panel, label="未完成訂單（點擊完成）")
         title1.SetFont(wx.Font(12, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD))
         left_sizer.Add(title1, 0, wx.EXPAND | wx.ALL, 5)
 
-        self.pending_scrolled = wx.ScrolledWindow(left_panel, style=wx.VSCROLL)
-        self.pending_scrolled.SetScrollRate(5, 5)
-        self.pending_vbox = wx.BoxSizer(wx.VERTICAL)
-        self.pending_scrolled.SetSizer(self.pending_vbox)
-        left_sizer.Add(self.pending_scrolled, 1, wx.EXPAND)
+        self.pending_list = OrderListCtrl(left_panel, self.cache, completed=False, refresher=self.refresher)
+        left_sizer.Add(self.pending_list, 1, wx.EXPAND)
 
         left_panel.SetSizer(left_sizer)
 
@@ -29,15 +181,12 @@ class ReportPanel(wx.Panel):
         right_panel = wx.Panel(splitter)
         right_sizer = wx.BoxSizer(wx.VERTICAL)
 
-        title2 = wx.StaticText(right_panel, label="已完成訂單")
+        title2 = wx.StaticText(right_panel, label="已完成訂單（今天起，往下捲載入更早）")
         title2.SetFont(wx.Font(12, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_BOLD))
         right_sizer.Add(title2, 0, wx.EXPAND | wx.ALL, 5)
 
-        self.completed_scrolled = wx.ScrolledWindow(right_panel, style=wx.VSCROLL)
-        self.completed_scrolled.SetScrollRate(5, 5)
-        self.completed_vbox = wx.BoxSizer(wx.VERTICAL)
-        self.completed_scrolled.SetSizer(self.completed_vbox)
-        right_sizer.Add(self.completed_scrolled, 1, wx.EXPAND)
+        self.completed_list = OrderListCtrl(right_panel, self.cache, completed=True, refresher=self.refresher)
+        right_sizer.Add(self.completed_list, 1, wx.EXPAND)
 
         right_panel.SetSizer(right_sizer)
 
@@ -45,84 +194,106 @@ class ReportPanel(wx.Panel):
         splitter.SplitVertically(left_panel, right_panel)
         splitter.SetSashGravity(0.5)  # 左右各半
 
+        # 上方：今日銷售摘要 + 重新整理
+        self.summary = SalesSummaryPanel(self, self.orders)
+        refresh_btn = wx.Button(self, label="重新整理")
+        refresh_btn.Bind(wx.EVT_BUTTON, lambda e: self.load_order_details())
+
+        top_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        top_sizer.Add(self.summary, 1, wx.EXPAND)
+        top_sizer.Add(refresh_btn, 0, wx.ALL, 5)
+
         main_sizer = wx.BoxSizer(wx.VERTICAL)
+        main_sizer.Add(top_sizer, 0, wx.EXPAND)
+        main_sizer.SetItemMinSize(top_sizer, -1, 170)
         main_sizer.Add(splitter, 1, wx.EXPAND)
         self.SetSizer(main_sizer)
-        self.completed_scrolled.SetBackgroundColour(self.GetBackgroundColour())
-        self.pending_scrolled.SetBackgroundColour(self.GetBackgroundColour())
+
+        # 點擊未完成訂單 → 完成
+        self.pending_list.Bind(wx.EVT_LEFT_DOWN, self.on_pending_click)
+
+        # 定期檢查其他終端機的訂單（伺服器模式下各終端機共用同一份訂單）
+        self.poll_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_poll_timer, self.poll_timer)
+        self.poll_timer.Start(ORDER_POLL_MS)
 
         self.load_order_details()
 
-    def create_block(self, oid, parent_sizer):
-        conn = get_connection()
-        cur = conn.cursor()
-        scrolled = self.pending_scrolled if parent_sizer == self.pending_vbox else self.completed_scrolled
-        block_panel = wx.Panel(scrolled, style=wx.BORDER_SIMPLE)
-        block_sizer = wx.BoxSizer(wx.VERTICAL)
-
-        cur.execute("SELECT PID, QTY, SUBTOTAL FROM ORDER_DETAIL WHERE OID=?", (oid,))
-        details = cur.fetchall()
-
-        block_sizer.Add(wx.StaticText(block_panel, label=f"訂單編號: {oid}"), 0, wx.ALL, 5)
-        # 3. report.py 的 create_block() 安全取名稱
-        for pid, qty, subtotal in details:
-            cur.execute("SELECT NAME FROM PRODUCT WHERE PID = ?", (pid,))
-            row = cur.fetchone()
-            name = row[0] if row else f"[已刪除] {pid}"
-            block_sizer.Add(wx.StaticText(block_panel, label=f"商品: {name}  數量: {qty}  小計: {subtotal:.2f}"),
-                            0, wx.LEFT | wx.BOTTOM, 5)
-        cur.execute("SELECT TOTAL FROM ORDER_MASTER WHERE OID=?", (oid,))
-        total = cur.fetchone()[0]
-        block_sizer.Add(wx.StaticText(block_panel, label=f"總計: {total:.2f}"), 0, wx.LEFT | wx.BOTTOM, 5)
-
-        block_panel.SetSizer(block_sizer)
-        parent_sizer.Add(block_panel, 0, wx.EXPAND | wx.ALL, 5)
-
-        # 點擊完成
-        block_panel.Bind(wx.EVT_LEFT_DOWN, lambda e, o=oid, p=block_panel: self.complete_order(o, p))
-
-        conn.close()
-        return block_panel
-
-    def complete_order(self, oid, panel):
-        self.pending_vbox.Detach(panel)
-        panel.Reparent(self.completed_scrolled)
-        self.completed_vbox.Add(panel, 0, wx.EXPAND | wx.ALL, 5)
-
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("UPDATE ORDER_MASTER SET COMPLETED = 1 WHERE OID = ?", (oid,))
-        conn.commit()
-        conn.close()
-
-        # 先算「新增」的右邊，再算左邊
-        self.completed_scrolled.FitInside()
-        self.pending_scrolled.FitInside()
-        self.Layout()
+    def on_pending_click(self, event):
+        row, flags = self.pending_list.HitTest(event.GetPosition())
+        if row == wx.NOT_FOUND:
+            event.Skip()
+            return
+        # 不 Skip：這一列會被移走，原生的選取會落到往上遞補的下一筆訂單
+        self.complete_order(self.cache.pending[row])
+
+    # ---------------------------
+    # 增量更新：只處理變動的那一筆訂單
+    # ---------------------------
+    def add_order(self, oid):
+        """新訂單送出後呼叫：在背景只查這一筆，再加入對應清單"""
+        if self.loader.busy():
+            # 完整重新同步進行中（可能在這筆寫入前就讀過了）：重新同步一次，新的結果會包含這一筆
+            self.load_order_details()
+            return
+        generation = self.cache.generation
+        run_in_background(lambda: self.orders.get(oid), self._order_loaded,
+                          stale=lambda: self.cache.generation != generation, owner=self)
+        self.summary.refresh()
+
+    def _order_loaded(self, order):
+        order = self.cache.insert(order)
+        if order is None:
+            return
+        lst = self.completed_list if order.completed else self.pending_list
+        lst.refresh_rows()
+
+    def complete_order(self, oid):
+        # 已完成的訂單再點一次不處理
+        if self.cache.index(False, oid) is None:
+            return
+
+        try:
+            self.orders.complete(oid)
+        except (sqlite3.Error, ServerError) as e:
+            wx.MessageBox(f"完成訂單失敗：{e}", "錯誤", wx.OK | wx.ICON_ERROR)
+            return
+
+        self.cache.mark_completed(oid)
+        self.completed_list.refresh_rows()
+        self.pending_list.refresh_rows()
+        if self.loader.busy():
+            # 進行中的重新同步可能讀到完成前的狀態
+            self.load_order_details()
 
     def load_order_details(self):
-        # 清空
-        for child in self.pending_scrolled.GetChildren():
-            child.Destroy()
-        for child in self.completed_scrolled.GetChildren():
-            child.Destroy()
-        self.pending_vbox.Clear()
-        self.completed_vbox.Clear()
-
-        conn = get_connection()
-        cur = conn.cursor()
-
-        # 讀未完成
-        cur.execute("SELECT OID FROM ORDER_MASTER WHERE COMPLETED = 0 ORDER BY OID")
-        for row in cur.fetchall():
-            self.create_block(row[0], self.pending_vbox)
-
-        # 讀已完成
-        cur.execute("SELECT OID FROM ORDER_MASTER WHERE COMPLETED = 1 ORDER BY OID")
-        for row in cur.fetchall():
-            self.create_block(row[0], self.completed_vbox)
-
-        conn.close()
-        self.pending_scrolled.FitInside()
-        self.completed_scrolled.FitInside()
-        self.Layout()
\ No newline at end of file
+        """完整重新同步（重新整理按鈕、定期檢查發現其他終端機的變動時；平常請用 add_order / complete_order）
+
+        在背景讀取，讀完才一次換掉兩個清單；讀取期間畫面照常操作，
+        期間再次呼叫時前一次的結果會被丟掉。
+        """
+        self.loader.load(self.cache.fetch_reload, self._apply_reload)
+        self.summary.refresh()
+
+    def _apply_reload(self, data):
+        self.cache.apply_reload(data)
+        self.pending_list.refresh_rows()
+        self.completed_list.refresh_rows()
+
+    # ---------------------------
+    # 定期檢查：其他終端機新增 / 完成的訂單
+    # ---------------------------
+    def on_poll_timer(self, event):
+        # 看不到這一頁或正在重新同步時不檢查
+        if self.loader.busy() or not self.IsShownOnScreen():
+            return
+        generation = self.cache.generation
+        run_in_background(self.orders.pending, self._pending_polled,
+                          on_error=lambda e: None,
+                          stale=lambda: self.cache.generation != generation or self.loader.busy(),
+                          owner=self)
+
+    def _pending_polled(self, pending):
+        # 本機的送出 / 完成已逐筆套用；未完成清單還是不同，代表有其他終端機的變動
+        if {row[0] for row in pending} != set(self.cache.pending):
+            self.load_order_details()
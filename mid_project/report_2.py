@@ -1,5 +1,5 @@
 import wx
-from db import get_connection
+from order_store import iter_orders
 
 class ReportPanel(wx.Panel):
     def __init__(self, parent):
@@ -22,34 +22,21 @@ class ReportPanel(wx.Panel):
             child.Destroy()
         self.vbox.Clear()
 
-        conn = get_connection()
-        cur = conn.cursor()
-
-        # 取得所有 order_id
-        cur.execute("SELECT DISTINCT OID FROM ORDER_DETAIL ORDER BY OID")
-        order_ids = [row[0] for row in cur.fetchall()]
-
-        for oid in order_ids:
+        # 一次 JOIN 查詢取得所有訂單與明細
+        for order in iter_orders():
+            if not order.items:
+                continue
             block_panel = wx.Panel(self.scrolled, style=wx.BORDER_SIMPLE)
             block_sizer = wx.BoxSizer(wx.VERTICAL)
 
-            # 訂單明細
-            cur.execute("SELECT PID, QTY, SUBTOTAL FROM ORDER_DETAIL WHERE OID=?", (oid,))
-            details = cur.fetchall()
-
-            block_sizer.Add(wx.StaticText(block_panel, label=f"訂單編號: {oid}"), 0, wx.ALL, 5)
-            for pid, qty, subtotal in details:
-                cur.execute("SELECT NAME FROM PRODUCT WHERE PID=?", (pid,))
-                name = cur.fetchone()[0]
+            block_sizer.Add(wx.StaticText(block_panel, label=f"訂單編號: {order.oid}"), 0, wx.ALL, 5)
+            for pid, name, qty, subtotal in order.items:
                 block_sizer.Add(wx.StaticText(block_panel, label=f"商品: {name}  數量: {qty}  小計: {subtotal:.2f}"), 0, wx.LEFT | wx.BOTTOM, 5)
-            cur.execute("SELECT TOTAL FROM ORDER_MASTER WHERE OID=?", (oid,))
-            details = cur.fetchone()[0]
-            total = details
+            total = order.total
             block_sizer.Add(wx.StaticText(block_panel, label=f"總計: {total}"), 0, wx.LEFT | wx.BOTTOM, 5)
 
             block_panel.SetSizer(block_sizer)
             self.vbox.Add(block_panel, 0, wx.EXPAND | wx.ALL, 5)
 
-        conn.close()
         self.scrolled.Layout()
 
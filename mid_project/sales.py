@@ -0,0 +1,92 @@
+import sys
+import argparse
+import datetime
+from collections import namedtuple
+from db import read_snapshot, transaction, rebuild_sales_summary, init_db
+
+# 銷售統計查詢：只讀 SALES_DAILY / SALES_HOURLY / SALES_PRODUCT（由 trigger 維護），
+# 不論累積多少歷史訂單，查一天的數字都只是幾次索引查詢
+
+# 一個時段（某天或某小時）的銷售：key 為 'YYYY-MM-DD' 或 'YYYY-MM-DD HH'
+SalesTotal = namedtuple("SalesTotal", "key orders qty revenue")
+
+# 某天某商品的銷售；name 含已刪除商品
+ProductSales = namedtuple("ProductSales", "pid name orders qty revenue")
+
+# 一天的完整摘要：total 為 SalesTotal，hours / products 為 list
+DaySummary = namedtuple("DaySummary", "day total hours products")
+
+
+def today():
+    return datetime.date.today().isoformat()
+
+
+def day_summary(day=None, top=20):
+    """某天（預設今天）的總計、各小時與銷售額前 top 名的商品"""
+    day = day or today()
+    with read_snapshot() as cur:
+        cur.execute("SELECT ORDERS, QTY, REVENUE FROM SALES_DAILY WHERE DAY = ?", (day,))
+        row = cur.fetchone()
+        total = SalesTotal(day, *row) if row else SalesTotal(day, 0, 0, 0)
+
+        cur.execute("""
+            SELECT HOUR, ORDERS, QTY, REVENUE FROM SALES_HOURLY
+            WHERE HOUR >= ? AND HOUR < ? ORDER BY HOUR
+        """, (day + " 00", day + " 99"))
+        hours = [SalesTotal(*r) for r in cur.fetchall()]
+
+        cur.execute("""
+            SELECT S.PID, P.NAME, S.ORDERS, S.QTY, S.REVENUE
+            FROM SALES_PRODUCT S
+            LEFT JOIN PRODUCT P ON P.PID = S.PID
+            WHERE S.DAY = ?
+            ORDER BY S.REVENUE DESC, S.PID
+            LIMIT ?
+        """, (day, top))
+        products = [ProductSales(pid, name if name is not None else f"[已刪除] {pid}", orders, qty, revenue)
+                    for pid, name, orders, qty, revenue in cur.fetchall()]
+    return DaySummary(day, total, hours, products)
+
+
+def daily_totals(date_from, date_to):
+    """每日總計 [SalesTotal]，date_from 含、date_to 不含（'YYYY-MM-DD'）"""
+    with read_snapshot() as cur:
+        cur.execute("""
+            SELECT DAY, ORDERS, QTY, REVENUE FROM SALES_DAILY
+            WHERE DAY >= ? AND DAY < ? ORDER BY DAY
+        """, (date_from, date_to))
+        return [SalesTotal(*r) for r in cur.fetchall()]
+
+
+def rebuild():
+    """從訂單資料重算所有銷售統計（資料表被手動修改過、或懷疑數字不一致時用）"""
+    with transaction() as cur:
+        rebuild_sales_summary(cur)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="銷售統計")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="從訂單資料重算銷售統計表")
+    s = sub.add_parser("show", help="顯示某天的銷售摘要")
+    s.add_argument("day", nargs="?", help="YYYY-MM-DD（預設今天）")
+    args = parser.parse_args(argv)
+
+    init_db()
+    if args.command == "rebuild":
+        rebuild()
+        print("銷售統計已重算")
+        return 0
+
+    summary = day_summary(args.day)
+    t = summary.total
+    print(f"{summary.day}：{t.orders} 筆訂單，{t.qty} 件，營業額 {t.revenue:.2f}")
+    for h in summary.hours:
+        print(f"  {h.key[-2:]} 時  {h.orders:5d} 筆  {h.qty:6d} 件  {h.revenue:12.2f}")
+    for p in summary.products:
+        print(f"  {p.name:20s}  {p.qty:6d} 件  {p.revenue:12.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import sys
+import json
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import db
+from db import init_db, READER_POOL_SIZE
+from backup import BackupScheduler
+from services import CatalogService, OrderService
+from order_store import commit_order
+from write_pipeline import get_pipeline
+from remote import parse_address, encode_order, encode_page, encode_result, encode_summary
+
+# 本機訂單伺服器：由這個程式獨佔 pos.db，各終端機（python main.py --server host:port）
+# 透過 loopback 連線送出請求。所有寫入都排進同一個佇列，由唯一的寫入執行緒（WritePipeline）
+# 依序執行並 group commit，終端機之間不會再互搶 SQLite 寫入鎖（database is locked）。
+
+# 一個請求（一行 JSON）的大小上限；批次匯入商品時一行可能有數百 KB
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+
+class OrderServer:
+    def __init__(self, address=None):
+        self.host, self.port = parse_address(address)
+        self.catalog = CatalogService()
+        self.orders = OrderService()
+        self.pipeline = get_pipeline()
+        # 讀取用和讀取連線池一樣大的執行緒池
+        self._readers = ThreadPoolExecutor(max_workers=READER_POOL_SIZE, thread_name_prefix="pos-reader")
+
+        # 讀取：op -> func(**args)；回傳值必須可轉成 JSON（新增時也要加進 remote.READ_OPS，客戶端才會重送）
+        self.read_ops = {
+            "list_products": self.catalog.list_products,
+            "changed_products": self.catalog.changed_products,
+            "pending_orders": self.orders.pending,
+            "order_history": self._order_history,
+            "orders_by_oid": self._orders_by_oid,
+            "get_order": self._get_order,
+            "sales_summary": self._sales_summary,
+        }
+        # 寫入：op -> job(cur, **args)，在寫入執行緒的 SAVEPOINT 內執行
+        self.write_ops = {
+            "add_product": lambda cur, **a: self.catalog.add_product(**a),
+            "update_product": lambda cur, **a: self.catalog.update_product(**a),
+            "delete_product": lambda cur, **a: self.catalog.delete_product(**a),
+            "import_products": self._import_products,
+            "submit_order": self._submit_order,
+            "complete_order": lambda cur, oid: OrderService.complete_job(oid)(cur),
+        }
+
+    # ---------------------------
+    # JSON 轉換
+    # ---------------------------
+    @staticmethod
+    def _submit_order(cur, items):
+        # 已在寫入執行緒的交易內：commit_order 的交易會變成 SAVEPOINT
+        return encode_result(commit_order([tuple(item) for item in items]))
+
+    def _import_products(self, cur, products, delete_missing=False):
+        return list(self.catalog.import_products([tuple(p) for p in products], delete_missing))
+
+    def _order_history(self, after=None, limit=100, **filters):
+        return encode_page(self.orders.history(tuple(after) if after else None, limit, **filters))
+
+    def _orders_by_oid(self, oids):
+        return [encode_order(o) for o in self.orders.orders_by_oid(oids)]
+
+    def _get_order(self, oid):
+        return encode_order(self.orders.get(oid))
+
+    def _sales_summary(self, day=None, top=20):
+        return encode_summary(self.orders.sales_summary(day, top))
+
+    # ---------------------------
+    # 分派：寫入進寫入管線，讀取進讀取執行緒池
+    # ---------------------------
+    async def dispatch(self, op, args):
+        if op in self.write_ops:
+            job = self.write_ops[op]
+            fut = self.pipeline.submit(lambda cur: job(cur, **args))
+            return await asyncio.wrap_future(fut)
+        if op in self.read_ops:
+            func = self.read_ops[op]
+            return await asyncio.get_running_loop().run_in_executor(self._readers, lambda: func(**args))
+        raise ValueError(f"不支援的操作：{op}")
+
+    # ---------------------------
+    # 連線處理
+    # ---------------------------
+    @staticmethod
+    async def _reply(writer, resp):
+        writer.write(json.dumps(resp, ensure_ascii=False).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # 超過 MAX_REQUEST_BYTES：剩下的資料已無法對齊下一個請求，回覆錯誤後關閉連線
+                    await self._reply(writer, {"ok": False, "type": "ValueError",
+                                               "error": f"請求超過 {MAX_REQUEST_BYTES // 1048576} MB 上限"})
+                    break
+                if not line:
+                    break
+                try:
+                    req = json.loads(line)
+                    result = await self.dispatch(req["op"], req.get("args") or {})
+                    resp = {"ok": True, "result": result}
+                except ValueError as e:
+                    resp = {"ok": False, "type": "ValueError", "error": str(e)}
+                except Exception as e:
+                    resp = {"ok": False, "type": type(e).__name__, "error": str(e)}
+                await self._reply(writer, resp)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                            limit=MAX_REQUEST_BYTES)
+        print(f"訂單伺服器啟動：{self.host}:{self.port}", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pipeline.stop()
+            self._readers.shutdown(wait=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="點餐系統本機訂單伺服器")
+    parser.add_argument("address", nargs="?", help="監聽位址 host:port（預設 127.0.0.1:8765）")
+    parser.add_argument("--db", help=f"資料庫檔（預設 {db.DB_FILE}，或設定 POS_DB）")
+    args = parser.parse_args(argv)
+    if args.db:
+        db.set_db_file(args.db)
+
+    init_db()
+    # 定時線上備份（POS_BACKUP_INTERVAL_MIN 分鐘一次，0 代表不備份）
+    BackupScheduler().start()
+    server = OrderServer(args.address)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
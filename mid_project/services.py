@@ -0,0 +1,332 @@
+import os
+import math
+from collections import namedtuple
+from db import read_cursor, read_snapshot, transaction, generate_pid, reserve_pids
+from order_store import commit_order, fetch_order_history, get_order, get_orders, list_pending
+from write_pipeline import get_pipeline
+from sales import day_summary
+
+# 業務邏輯層：不依賴 wx，可在沒有畫面的程式、腳本或壓力測試中直接使用
+# 錯誤一律丟 ValueError（訊息可直接顯示給使用者），與各 Panel 的處理方式一致
+
+# 多台終端機模式：設定成 "host:port" 時，商品與訂單改由 server.py 處理，不直接開 pos.db
+SERVER_ADDRESS = os.environ.get("POS_SERVER") or None
+
+# 批次匯入的結果（各項筆數）
+ImportResult = namedtuple("ImportResult", "added updated unchanged deleted")
+
+
+class CartService:
+    """購物車：品項、預扣庫存與總金額（只在記憶體，送出前不寫 DB）
+
+    品項以 pid 為 key 存放，加入 / 合併 / 修改數量與查列號都是 O(1)；總金額隨每次變動累加。
+    列號（對應點餐頁 order_list 的列）依加入順序，刪除時後面的列往前遞補，
+    和 ListCtrl.DeleteItem 的行為一致——所以刪除是 O(n)（n 為刪除位置之後的列數）。
+    """
+
+    def __init__(self):
+        self.lines = {}   # pid -> (pid, name, qty, subtotal)，依加入順序
+        self.stock = {}   # pid -> 目前可賣量（已扣掉購物車佔用的數量）
+        self.info = {}    # pid -> (name, price)
+        self._total = 0
+        self._pids = []   # 列號 -> pid
+        self._rows = {}   # pid -> 列號
+
+    # ---------------------------
+    @property
+    def items(self):
+        """品項 list of tuples (pid, name, qty, subtotal)，依列號排序（送出訂單用）"""
+        return list(self.lines.values())
+
+    def load_products(self, products):
+        """載入商品 [(pid, name, price, stock)]；DB 庫存會扣掉購物車已佔用的數量"""
+        self.stock.clear()
+        self.info.clear()
+        for pid, name, price, stock in products:
+            line = self.lines.get(pid)
+            self.stock[pid] = stock - (line[2] if line else 0)
+            self.info[pid] = (name, price)
+
+    def index_of(self, pid):
+        """pid 在購物車中的列號；不在購物車回傳 None"""
+        return self._rows.get(pid)
+
+    def at(self, row):
+        """第 row 列的品項 (pid, name, qty, subtotal)"""
+        return self.lines[self._pids[row]]
+
+    def available(self, pid):
+        """修改數量時的上限：剩餘可賣量 + 購物車中原有數量"""
+        line = self.lines.get(pid)
+        in_cart = line[2] if line else 0
+        return self.stock.get(pid, 0) + in_cart
+
+    def total(self):
+        return self._total
+
+    def _put(self, pid, item):
+        """寫入品項並累加總金額差額，回傳列號"""
+        old = self.lines.get(pid)
+        self.lines[pid] = item
+        if old is None:
+            self._total += item[3]
+            self._rows[pid] = len(self._pids)
+            self._pids.append(pid)
+        else:
+            self._total += item[3] - old[3]
+        return self.index_of(pid)
+
+    # ---------------------------
+    def add(self, pid, qty):
+        """加入商品（已存在則合併），回傳 (index, item, is_new)"""
+        if pid not in self.info:
+            raise ValueError("找不到商品資訊")
+        name, price = self.info[pid]
+        cur_stock = self.stock.get(pid, 0)
+        if qty <= 0:
+            raise ValueError("數量必須大於 0！")
+        if qty > cur_stock:
+            raise ValueError(f"庫存不足！目前僅剩 {cur_stock}。")
+
+        old = self.lines.get(pid)
+        is_new = old is None
+        new_qty = qty if is_new else old[2] + qty
+        item = (pid, name, new_qty, new_qty * price)
+        i = self._put(pid, item)
+
+        # 更新暫存庫存（減掉剛剛加入的 qty）
+        self.stock[pid] = cur_stock - qty
+        return i, item, is_new
+
+    def set_qty(self, pid, new_qty):
+        """修改數量，回傳 (index, item)"""
+        old = self.lines.get(pid)
+        if old is None:
+            raise ValueError("購物車中沒有這項商品！")
+        old_qty = old[2]
+        available = self.stock.get(pid, 0) + old_qty
+        if new_qty <= 0:
+            raise ValueError("數量必須大於 0（若要移除請使用刪除）！")
+        if new_qty > available:
+            raise ValueError(f"庫存不足！最多可設為 {available}。")
+
+        name, price = self.info[pid]
+        # delta > 0 扣更多暫存庫存；delta < 0 回補
+        self.stock[pid] = self.stock.get(pid, 0) - (new_qty - old_qty)
+        item = (pid, name, new_qty, new_qty * price)
+        return self._put(pid, item), item
+
+    def remove(self, pid):
+        """移除品項並回補暫存庫存，回傳被移除的 index"""
+        i = self.index_of(pid)
+        if i is None:
+            raise ValueError("購物車中沒有這項商品！")
+        line = self.lines.pop(pid)
+        self.stock[pid] = self.stock.get(pid, 0) + line[2]
+        # 後面的列號都往前一格：只更新移動到的那幾列（O(n)，和 ListCtrl.DeleteItem 一樣）
+        del self._pids[i]
+        del self._rows[pid]
+        for row in range(i, len(self._pids)):
+            self._rows[self._pids[row]] = row
+        # 清空時歸零，避免浮點數累加的誤差留下來
+        self._total = self._total - line[3] if self.lines else 0
+        return i
+
+    def clear(self):
+        """清空購物車（送出成功後用，暫存庫存等重新載入時再更新）"""
+        self.lines.clear()
+        self._pids.clear()
+        self._rows.clear()
+        self._total = 0
+
+
+class CatalogService:
+    """商品維護：查詢、新增、修改、軟刪除"""
+
+    def list_products(self):
+        """所有未刪除商品 [(pid, name, price, stock)]"""
+        with read_cursor() as cur:
+            # ORDER BY PID：維持新增順序（否則可能依名稱索引的順序回傳）
+            cur.execute("SELECT PID, NAME, PRICE, STOCK FROM PRODUCT WHERE DELETED = 0 ORDER BY PID")
+            return cur.fetchall()
+
+    def changed_products(self, since):
+        """回傳 (目前 PRODUCT_VERSION, 版本比 since 新的商品 [(pid, name, price, stock, deleted)])
+
+        兩個查詢在同一個讀取快照內，不會漏掉中間被改的列。
+        """
+        with read_snapshot() as cur:
+            cur.execute("SELECT VALUE FROM ID_SEQUENCE WHERE NAME = 'PRODUCT_VERSION'")
+            row = cur.fetchone()
+            version = row[0] if row else 0
+            if version == since:
+                return version, []
+            cur.execute("""
+                SELECT PID, NAME, PRICE, STOCK, DELETED FROM PRODUCT
+                WHERE ROW_VERSION > ? ORDER BY PID
+            """, (since,))
+            return version, cur.fetchall()
+
+    @staticmethod
+    def _validate(name, price, stock):
+        if not name:
+            raise ValueError("名稱不可為空！")
+        if not math.isfinite(price):
+            raise ValueError("價格必須是有限的數字！")
+        if price < 0 or stock < 0:
+            raise ValueError("價格與庫存不可為負數！")
+
+    def add_product(self, name, price, stock):
+        """新增商品，回傳自動產生的 PID"""
+        self._validate(name, price, stock)
+        with transaction() as cur:
+            # 檢查名稱重複
+            cur.execute("SELECT 1 FROM PRODUCT WHERE NAME = ? AND DELETED = 0", (name,))
+            if cur.fetchone():
+                raise ValueError("商品名稱已存在！")
+
+            # 自動產生 PID（與 INSERT 同一個交易）
+            pid = generate_pid(cur)
+
+            cur.execute("""
+                INSERT INTO PRODUCT (PID, NAME, PRICE, STOCK, DELETED)
+                VALUES (?, ?, ?, ?, 0)
+            """, (pid, name, price, stock))
+        return pid
+
+    def update_product(self, pid, name, price, stock):
+        if not pid:
+            raise ValueError("請先選擇要修改的商品！")
+        self._validate(name, price, stock)
+        with transaction() as cur:
+            # 確認商品存在
+            cur.execute("SELECT 1 FROM PRODUCT WHERE PID = ? AND DELETED = 0", (pid,))
+            if not cur.fetchone():
+                raise ValueError("找不到該商品編號！")
+
+            # 改名時也不可與其他商品重複（UX_PRODUCT_NAME_ACTIVE 唯一索引）
+            cur.execute("SELECT 1 FROM PRODUCT WHERE NAME = ? AND DELETED = 0 AND PID <> ?", (name, pid))
+            if cur.fetchone():
+                raise ValueError("商品名稱已存在！")
+
+            cur.execute("""
+                UPDATE PRODUCT SET NAME = ?, PRICE = ?, STOCK = ?
+                WHERE PID = ? AND DELETED = 0
+            """, (name, price, stock, pid))
+
+    def delete_product(self, pid):
+        """軟刪除（DELETED = 1），歷史訂單仍查得到名稱"""
+        if not pid:
+            raise ValueError("請先選擇要刪除的商品！")
+        with transaction() as cur:
+            cur.execute("UPDATE PRODUCT SET DELETED = 1 WHERE PID = ?", (pid,))
+
+    def import_products(self, products, delete_missing=False):
+        """批次匯入 [(name, price, stock)]（已檢查過，見 product_import），以名稱對應現有商品
+
+        名稱已存在就更新價格與庫存，不存在就新增（PID 一次保留一整段）；
+        delete_missing=True 時，清單中沒有的現有商品會被軟刪除。
+        全部在同一個交易內以 executemany 寫入，回傳 ImportResult。
+        """
+        for name, price, stock in products:
+            self._validate(name, price, stock)
+        with transaction() as cur:
+            cur.execute("SELECT NAME, PID, PRICE, STOCK FROM PRODUCT WHERE DELETED = 0")
+            existing = {name: (pid, price, stock) for name, pid, price, stock in cur.fetchall()}
+
+            new = [p for p in products if p[0] not in existing]
+            changed = [(price, stock, existing[name][0]) for name, price, stock in products
+                       if name in existing and existing[name][1:] != (price, stock)]
+            missing = []
+            if delete_missing:
+                names = {p[0] for p in products}
+                missing = [(pid,) for name, (pid, price, stock) in existing.items() if name not in names]
+
+            if new:
+                pids = reserve_pids(cur, len(new))
+                cur.executemany("""
+                    INSERT INTO PRODUCT (PID, NAME, PRICE, STOCK, DELETED)
+                    VALUES (?, ?, ?, ?, 0)
+                """, [(pid, name, price, stock) for pid, (name, price, stock) in zip(pids, new)])
+            if changed:
+                cur.executemany("UPDATE PRODUCT SET PRICE = ?, STOCK = ? WHERE PID = ?", changed)
+            if missing:
+                cur.executemany("UPDATE PRODUCT SET DELETED = 1 WHERE PID = ?", missing)
+
+        unchanged = len(products) - len(new) - len(changed)
+        return ImportResult(len(new), len(changed), unchanged, len(missing))
+
+
+class OrderService:
+    """訂單：送出與完成
+
+    寫入都經過 WritePipeline（group commit）：尖峰時多筆送出 / 完成合併成一次 COMMIT，
+    回傳時該筆所在的那一組已確實寫入磁碟。
+    """
+
+    def __init__(self, pipeline=None):
+        self.pipeline = pipeline or get_pipeline()
+
+    def submit(self, cart):
+        """送出購物車，回傳 order_store.OrderResult；成功時清空購物車"""
+        if not cart.lines:
+            raise ValueError("請先加入商品！")
+        result = commit_order(cart.items, self.pipeline)
+        if result.ok:
+            cart.clear()
+        return result
+
+    @staticmethod
+    def complete_job(oid):
+        def job(cur):
+            cur.execute("UPDATE ORDER_MASTER SET COMPLETED = 1 WHERE OID = ? AND COMPLETED = 0", (oid,))
+            return cur.rowcount == 1
+        return job
+
+    def complete(self, oid):
+        """把訂單標記為完成；回傳是否真的有更新（已完成或不存在回傳 False）"""
+        return self.pipeline.run(self.complete_job(oid))
+
+    # ---------------------------
+    # 查詢（報表 OrderCache 使用）
+    # ---------------------------
+    def pending(self):
+        """所有未完成訂單 [(oid, date)]"""
+        return list_pending()
+
+    def history(self, after=None, limit=100, **filters):
+        """已完成 / 歷史訂單分頁，參數同 order_store.fetch_order_history"""
+        return fetch_order_history(after, limit, **filters)
+
+    def orders_by_oid(self, oids):
+        return get_orders(oids)
+
+    def get(self, oid):
+        return get_order(oid)
+
+    def sales_summary(self, day=None, top=20):
+        """某天的銷售摘要（sales.DaySummary），讀銷售統計表，不掃訂單明細"""
+        return day_summary(day, top)
+
+
+# ---------------------------
+# 依設定取得本機或伺服器版本的服務
+# ---------------------------
+def use_server(address):
+    """切換成伺服器模式（address 為 "host:port"；None 代表直接讀寫 pos.db）"""
+    global SERVER_ADDRESS
+    SERVER_ADDRESS = address or None
+
+
+def catalog_service():
+    if SERVER_ADDRESS:
+        from remote import RemoteCatalogService, get_client
+        return RemoteCatalogService(get_client(SERVER_ADDRESS))
+    return CatalogService()
+
+
+def order_service():
+    if SERVER_ADDRESS:
+        from remote import RemoteOrderService, get_client
+        return RemoteOrderService(get_client(SERVER_ADDRESS))
+    return OrderService()
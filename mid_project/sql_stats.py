@@ -0,0 +1,265 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import atexit
+import logging
+import sqlite3
+import datetime
+import threading
+from collections import Counter
+
+# SQL 量測：統計每個語句的次數、延遲（p50/p95/p99）、回傳列數與呼叫端，
+# 超過門檻的語句連同 EXPLAIN QUERY PLAN 寫進 log（logger "pos.sql"）。
+#
+# 預設關閉，db.get_connection 直接使用原本的 sqlite3.Connection，沒有額外負擔。
+# 設定下列環境變數之一即啟用：
+#   POS_SQL_STATS=sql_stats.json   統計結果輸出檔（程式結束時、或在主視窗按 Ctrl+Shift+F12）
+#   POS_SQL_SLOW_MS=50             慢查詢門檻（毫秒，預設 50）
+STATS_FILE = os.environ.get("POS_SQL_STATS") or None
+SLOW_MS = float(os.environ.get("POS_SQL_SLOW_MS") or 50)
+ENABLED = bool(STATS_FILE or os.environ.get("POS_SQL_SLOW_MS"))
+
+MAX_SAMPLES = 10000      # 每個語句最多保留幾筆延遲樣本（超過後隨機抽樣）
+CALLER_DEPTH = 3         # 呼叫端記錄幾層（例：report.ReportPanel.complete_order < ...）
+
+# 找呼叫端時略過的模組（連線管理、交易、執行緒等基礎設施）
+_SKIP_MODULES = {__name__, "db", "contextlib", "threading", "write_pipeline",
+                 "concurrent.futures.thread", "asyncio.events"}
+_EXPLAIN_PREFIXES = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+logger = logging.getLogger("pos.sql")
+
+
+def normalize(sql):
+    """同一種語句歸在一起：合併空白，IN (?, ?, ...) 不論幾個參數都視為同一句"""
+    sql = " ".join(sql.split())
+    return re.sub(r"\(\?(?:\s*,\s*\?)+\)", "(?, ...)", sql)
+
+
+def caller():
+    """呼叫 SQL 的畫面 / 方法（略過基礎設施模組）"""
+    names = []
+    frame = sys._getframe(1)
+    while frame is not None and len(names) < CALLER_DEPTH:
+        module = frame.f_globals.get("__name__", "?")
+        if module not in _SKIP_MODULES:
+            code = frame.f_code
+            names.append(f"{module}.{getattr(code, 'co_qualname', code.co_name)}")
+        frame = frame.f_back
+    return " < ".join(names) or "?"
+
+
+# ---------------------------
+# 統計
+# ---------------------------
+class StatementStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.samples = []
+        self.callers = Counter()
+
+    def add(self, elapsed, rows, who, slow):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.rows += rows
+        self.slow += slow
+        self.callers[who] += 1
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(elapsed)
+        else:
+            # reservoir sampling：樣本數固定，仍能代表全部的分布
+            i = random.randrange(self.count)
+            if i < MAX_SAMPLES:
+                self.samples[i] = elapsed
+
+    def summary(self):
+        samples = sorted(self.samples)
+        n = len(samples)
+
+        def pct(p):
+            return round(samples[min(n - 1, int(p * n))] * 1000, 4)
+
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total / self.count * 1000, 4),
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "p99_ms": pct(0.99),
+            "max_ms": round(self.max * 1000, 4),
+            "rows": self.rows,
+            "slow": self.slow,
+            "callers": dict(self.callers.most_common()),
+        }
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def record(sql, params, elapsed, rows, who, conn):
+    slow = elapsed * 1000 >= SLOW_MS
+    key = normalize(sql)
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = _stats[key] = StatementStats()
+        stats.add(elapsed, rows, who, slow)
+    if slow:
+        _log_slow(sql, params, elapsed, rows, who, conn)
+
+
+def _log_slow(sql, params, elapsed, rows, who, conn):
+    plan = ""
+    if sql.lstrip().upper().startswith(_EXPLAIN_PREFIXES):
+        try:
+            # 用原生 cursor，避免 EXPLAIN 本身又被記錄
+            cur = sqlite3.Cursor(conn)
+            cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = "\n".join(f"    {row[-1]}" for row in cur.fetchall())
+            cur.close()
+        except sqlite3.Error as e:
+            plan = f"    (無法取得查詢計畫：{e})"
+    logger.warning("慢查詢 %.1f ms（%d 列）%s\n  %s\n  參數：%r\n%s",
+                   elapsed * 1000, rows, who, " ".join(sql.split()), params, plan)
+
+
+def snapshot():
+    """目前的統計，依累計時間由大到小"""
+    with _stats_lock:
+        items = [(sql, s.summary()) for sql, s in _stats.items()]
+    items.sort(key=lambda item: item[1]["total_ms"], reverse=True)
+    return {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "slow_ms": SLOW_MS,
+        "statements": [dict(sql=sql, **summary) for sql, summary in items],
+    }
+
+
+def dump(path=None):
+    """把統計寫成 JSON，回傳檔名；沒有啟用時回傳 None"""
+    path = path or STATS_FILE
+    if not ENABLED or not path:
+        return None
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, ensure_ascii=False, indent=2)
+    return path
+
+
+def reset():
+    with _stats_lock:
+        _stats.clear()
+
+
+# ---------------------------
+# 包裝後的連線 / cursor
+# ---------------------------
+class InstrumentedCursor(sqlite3.Cursor):
+    """記錄每個語句從 execute 到讀完結果的時間與列數"""
+
+    _pending = None    # [sql, params, elapsed, rows, caller]
+
+    def _finish(self):
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            record(*pending, self.connection)
+
+    def _timed(self, method, sql, params, many):
+        self._finish()
+        who = caller()
+        t0 = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            elapsed = time.perf_counter() - t0
+            sample = params[0] if many and isinstance(params, list) and params else params
+            # 修改類語句沒有結果列，用 rowcount 當作影響的列數
+            rows = max(self.rowcount, 0) if self.description is None else 0
+            self._pending = [sql, sample, elapsed, rows, who]
+            if self.description is None:
+                self._finish()
+
+    def execute(self, sql, params=()):
+        return self._timed(super().execute, sql, params, False)
+
+    def executemany(self, sql, seq_of_params):
+        if not isinstance(seq_of_params, (list, tuple)):
+            seq_of_params = list(seq_of_params)
+        return self._timed(super().executemany, sql, seq_of_params, True)
+
+    def _fetched(self, elapsed, rows, done):
+        pending = self._pending
+        if pending is not None:
+            pending[2] += elapsed
+            pending[3] += rows
+            if done:
+                self._finish()
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(time.perf_counter() - t0, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(time.perf_counter() - t0, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(time.perf_counter() - t0, len(rows), True)
+        return rows
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(time.perf_counter() - t0, 0, True)
+            raise
+        self._fetched(time.perf_counter() - t0, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            # 程式結束時模組可能已被清掉
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute 不會經過 cursor()，要另外導向
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+
+def connection_factory():
+    """db.get_connection 使用的連線類別：沒有啟用時就是原本的 sqlite3.Connection"""
+    return InstrumentedConnection if ENABLED else sqlite3.Connection
+
+
+if ENABLED and STATS_FILE:
+    atexit.register(dump)
@@ -0,0 +1,73 @@
+import os
+import json
+import time
+import atexit
+import logging
+import datetime
+
+# 開機計時：從程式啟動到可以點餐、到送出第一筆訂單（time-to-first-sale）各花了多久
+#
+# main.py 最先 import 本模組，以這個時間點為起點；各階段完成時呼叫 mark()。
+# 第一筆訂單送出時（或沒賣出任何東西就關閉程式時）把各階段的毫秒數
+# 附加一行 JSON 到 POS_STARTUP_LOG（預設資料庫旁的 startup_times.jsonl），每天開店一行，方便追蹤。
+LOG_FILE = os.environ.get("POS_STARTUP_LOG")
+LOG_NAME = "startup_times.jsonl"
+
+START = time.perf_counter()
+
+logger = logging.getLogger("pos.startup")
+
+_marks = {}          # 階段名稱 -> 距離起點的毫秒數（依發生順序）
+_reported = False
+
+
+def mark(name):
+    """記錄一個階段完成（同名只記第一次），回傳距離起點的毫秒數"""
+    if name not in _marks:
+        _marks[name] = round((time.perf_counter() - START) * 1000, 1)
+        logger.info("%s：%.1f ms", name, _marks[name])
+    return _marks[name]
+
+
+def marks():
+    return dict(_marks)
+
+
+def log_file(path=None):
+    """開機計時檔：參數、POS_STARTUP_LOG，預設為資料庫旁的 startup_times.jsonl"""
+    if path or LOG_FILE:
+        return os.path.abspath(path or LOG_FILE)
+    # 用到時才 import：本模組要最先載入，起點不能算進 db 的載入時間；也能跟著 --db 換位置
+    import db
+    return os.path.join(os.path.dirname(db.DB_FILE), LOG_NAME)
+
+
+def report(path=None):
+    """寫出一行開機計時（只寫一次），回傳檔名；已寫過或沒有任何紀錄時回傳 None"""
+    global _reported
+    if _reported or not _marks:
+        return None
+    _reported = True
+    path = log_file(path)
+    record = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "marks": marks(),
+    }
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.warning("無法寫入開機計時 %s：%s", path, e)
+        return None
+    return path
+
+
+def first_sale():
+    """第一筆訂單送出時呼叫"""
+    if not _reported:
+        mark("first_sale")
+        report()
+
+
+# 沒有送出訂單就關閉程式時也留下紀錄（沒有 first_sale 欄位）
+atexit.register(report)
@@ -0,0 +1,144 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import wx
+from catalog_cache import get_catalog_cache
+
+# 畫面資料的背景載入：查資料庫、整理成要顯示的字串都在工作執行緒做，
+# 結果用 wx.CallAfter 交回畫面執行緒套用；大量重新整理時畫面照樣可以點。
+#
+# 讀取共用一個小的執行緒池（讀取連線池 / 伺服器連線本身就是執行緒安全的），
+# 畫面執行緒只負責把整理好的結果放進元件。
+MAX_WORKERS = 2
+
+logger = logging.getLogger("pos.ui")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="pos-load")
+        return _executor
+
+
+def _call_after(func, *args):
+    # 程式關閉後（沒有 wx.App）就不再交回畫面
+    if wx.GetApp() is not None:
+        wx.CallAfter(func, *args)
+
+
+def _log_error(error):
+    logger.warning("背景載入失敗：%s", error)
+
+
+def run_in_background(fetch, apply, on_error=None, stale=None, owner=None):
+    """fetch() 在工作執行緒執行，完成後在畫面執行緒呼叫 apply(結果)；失敗時呼叫 on_error(例外)
+
+    stale()：回傳 True 代表結果已過時，開始前與套用前各檢查一次，過時就直接丟掉
+    owner：結果要套用的視窗；視窗已被銷毀時不套用
+    """
+    on_error = on_error or _log_error
+
+    def finish(callback, value):
+        if owner is not None and not owner:
+            return
+        if stale is not None and stale():
+            return
+        callback(value)
+
+    def run():
+        if stale is not None and stale():
+            return
+        try:
+            result = fetch()
+        except Exception as e:
+            _call_after(finish, on_error, e)
+        else:
+            _call_after(finish, apply, result)
+
+    return executor().submit(run)
+
+
+class BackgroundLoader:
+    """同一份資料的背景載入：再次 load() 時，前一次還沒套用的結果一律作廢
+
+    fetch(cancelled) 在工作執行緒執行；耗時的 fetch 可以在分批讀取之間呼叫 cancelled()，
+    回傳 True 就提早結束（回傳值會被丟掉）。
+    """
+
+    def __init__(self, owner=None):
+        self.owner = owner
+        self._generation = 0
+        self._applied = 0      # 最後一次完成（套用或失敗）的世代
+
+    def load(self, fetch, apply, on_error=None):
+        self._generation += 1
+        generation = self._generation
+
+        def cancelled():
+            return generation != self._generation
+
+        def done(callback):
+            def finish(value):
+                self._applied = generation
+                (callback or _log_error)(value)
+            return finish
+
+        return run_in_background(lambda: fetch(cancelled), done(apply), done(on_error),
+                                 stale=cancelled, owner=self.owner)
+
+    def cancel(self):
+        """丟掉進行中的載入"""
+        self._generation += 1
+        self._applied = self._generation
+
+    def busy(self):
+        """最新一次 load() 還沒套用"""
+        return self._applied != self._generation
+
+
+class CatalogSync:
+    """在背景和資料庫同步商品快取，變動通知回到畫面執行緒才發送給各畫面
+
+    同步進行中又被要求時，做完再補一次：送出訂單後的同步不會被前一次（還沒讀到新庫存的）結果蓋掉。
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._running = False
+        self._again = False
+
+    def request(self):
+        if self._running:
+            self._again = True
+            return
+        self._running = True
+        run_in_background(lambda: self.cache.refresh(notify=False), self._done, self._failed)
+
+    def _done(self, changed):
+        self._running = False
+        self.cache.notify(changed)
+        if self._again:
+            self._again = False
+            self.request()
+
+    def _failed(self, error):
+        # 暫時讀不到（伺服器斷線等）就等下一次要求
+        self._running = False
+        self._again = False
+        logger.info("商品同步失敗：%s", error)
+
+
+_catalog_sync = None
+
+
+def get_catalog_sync():
+    """全域共用的商品快取背景同步"""
+    global _catalog_sync
+    if _catalog_sync is None:
+        _catalog_sync = CatalogSync(get_catalog_cache())
+    return _catalog_sync
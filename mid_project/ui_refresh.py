@@ -0,0 +1,55 @@
+import wx
+
+
+class RefreshScheduler:
+    """把多次 Layout / Refresh 要求合併到下一輪事件迴圈一次處理
+
+    同一輪事件內的 layout() / refresh() 只標記視窗並排一次 wx.CallAfter；
+    flush 時每個視窗只 Layout（捲動視窗再 FitInside）一次，並包在 Freeze/Thaw 內，
+    清空購物車、同步大量商品庫存時不會重複 layout 好幾十次。
+    """
+
+    def __init__(self):
+        self._layout = {}     # id(window) -> (window, fit_inside)
+        self._refresh = {}    # id(window) -> window
+        self._scheduled = False
+
+    # ---------------------------
+    def layout(self, window, fit_inside=False):
+        """標記 window 需要重新 layout（fit_inside：ScrolledWindow 同時更新捲動範圍）"""
+        old = self._layout.get(id(window))
+        self._layout[id(window)] = (window, fit_inside or (old is not None and old[1]))
+        self._schedule()
+
+    def refresh(self, window):
+        """標記 window 需要重畫"""
+        self._refresh[id(window)] = window
+        self._schedule()
+
+    def _schedule(self):
+        if not self._scheduled:
+            self._scheduled = True
+            wx.CallAfter(self.flush)
+
+    # ---------------------------
+    def flush(self):
+        """立即處理所有標記（一般由 wx.CallAfter 呼叫）"""
+        self._scheduled = False
+        layout, self._layout = self._layout, {}
+        refresh, self._refresh = self._refresh, {}
+
+        for window, fit_inside in layout.values():
+            if not window:
+                # 視窗已被銷毀
+                continue
+            window.Freeze()
+            try:
+                window.Layout()
+                if fit_inside:
+                    window.FitInside()
+            finally:
+                window.Thaw()
+
+        for window in refresh.values():
+            if window:
+                window.Refresh()
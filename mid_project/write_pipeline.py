@@ -0,0 +1,142 @@
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeout
+from db import transaction
+
+# Group commit：把短時間內湧入的寫入（送出訂單、完成訂單…）合併成一個交易、只 fsync 一次。
+# 每個工作在自己的 SAVEPOINT 內執行，失敗只還原自己；呼叫端拿到的結果
+# 一定是在整組 COMMIT（synchronous=FULL，確實落盤）之後才回傳。
+MAX_BATCH = 32          # 一組最多幾個工作
+MAX_DELAY = 0.003       # 第一個工作進來後最多再等幾秒湊下一個（3ms）
+RUN_TIMEOUT = 30        # run() 最多等幾秒（資料庫被鎖住時不會讓畫面永遠卡住）
+
+_STOP = object()
+
+
+class WritePipeline:
+    """單一寫入執行緒 + 佇列；job 為 callable(cur)，回傳值即為該工作的結果"""
+
+    def __init__(self, max_batch=MAX_BATCH, max_delay=MAX_DELAY, durable=True):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.durable = durable
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    # ---------------------------
+    def start(self):
+        with self._start_lock:
+            # 寫入執行緒意外結束時重新啟動，之後的寫入才不會卡到逾時
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="pos-write-pipeline", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """處理完佇列中剩下的工作後結束"""
+        with self._start_lock:
+            if self._thread is None:
+                return
+            if self._thread.is_alive():
+                self._queue.put(_STOP)
+                self._thread.join()
+            self._thread = None
+
+    def submit(self, job):
+        """排入一個寫入工作，回傳 concurrent.futures.Future"""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("不可在寫入執行緒內再排入工作")
+        self.start()
+        fut = Future()
+        self._queue.put((job, fut))
+        return fut
+
+    def run(self, job, timeout=RUN_TIMEOUT):
+        """排入工作並等到它所在的那一組確實寫入後才回傳結果（失敗時丟出原本的例外）
+
+        等超過 timeout 秒還沒開始執行就取消，丟 sqlite3.OperationalError（工作不會再被執行）；
+        已經開始執行的工作不能取消，會等到它的結果（最多再等 busy_timeout）。
+        """
+        fut = self.submit(job)
+        try:
+            return fut.result(timeout)
+        except FutureTimeout:
+            if fut.cancel():
+                raise sqlite3.OperationalError(f"資料庫忙碌，寫入等候超過 {timeout} 秒，已取消") from None
+            return fut.result()
+
+    # ---------------------------
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            stop = False
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch):
+        outcomes = []
+        try:
+            with transaction(durable=self.durable):
+                for job, fut in batch:
+                    if not fut.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        # 巢狀 transaction() = SAVEPOINT，失敗只還原這個工作
+                        with transaction() as cur:
+                            result = job(cur)
+                    except Exception as e:
+                        outcomes.append((fut, False, e))
+                    else:
+                        outcomes.append((fut, True, result))
+        except Exception as e:
+            # BEGIN（例如等寫入鎖逾時）或 COMMIT 失敗：整組都沒有寫入，
+            # 還沒開始的工作也要通知，否則呼叫端會一直等下去
+            for job, fut in batch:
+                self._resolve(fut, False, e)
+            return
+
+        for fut, ok, value in outcomes:
+            self._resolve(fut, ok, value)
+
+    @staticmethod
+    def _resolve(fut, ok, value):
+        # run() 逾時可能同時取消還沒開始的工作：已經有結果（或已取消）就略過，不能讓寫入執行緒死掉
+        try:
+            if ok:
+                fut.set_result(value)
+            else:
+                fut.set_exception(value)
+        except InvalidStateError:
+            pass
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    """全域共用的寫入管線（第一次使用時啟動，程式結束前會把剩下的工作寫完）"""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = WritePipeline()
+            atexit.register(_pipeline.stop)
+        return _pipeline